@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Admission control for expensive requests.
+
+Only work that needs a dictionary lookup goes through the controller: at
+most ``limit`` such requests run at once and at most ``queue_depth`` wait for
+a slot, each for no longer than ``queue_timeout`` seconds.  Everything beyond
+that is refused immediately, so cache hits and static files, which never
+queue here, keep their latency when cold traffic surges.
+"""
+
+import threading
+import time
+
+
+# how long an admitted-to-queue request waits for a slot before giving up
+ADMISSION_TIMEOUT_SECONDS = 1.0
+# Retry-After sent with 503 responses
+RETRY_AFTER_SECONDS = 1
+
+
+def default_limits(workers):
+    """(limit, queue_depth) leaving about a quarter of ``workers`` free for cheap requests."""
+    limit = max(1, workers // 2)
+    return limit, max(0, workers - limit - max(1, workers // 4))
+
+
+class AdmissionController(object):
+    def __init__(self, limit, queue_depth, queue_timeout=ADMISSION_TIMEOUT_SECONDS):
+        self.limit = limit
+        self.queue_depth = queue_depth
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Take a slot, waiting in the queue if there is room; False if the request must be shed."""
+        with self._cond:
+            if self.running < self.limit:
+                self.running += 1
+                return True
+            if self.waiting >= self.queue_depth:
+                self.rejected += 1
+                return False
+            self.waiting += 1
+            try:
+                deadline = time.time() + self.queue_timeout
+                while self.running >= self.limit:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        return False
+                    self._cond.wait(remaining)
+                self.running += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.running -= 1
+            self._cond.notify()
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""asyncio front end for the mdx-server WSGI application, built on aiohttp.
+
+Idle keep-alive connections cost nothing but a socket here.  Cached JSON
+entries and 304 revalidations are answered directly on the event loop; every
+other request runs the WSGI application on a bounded thread pool, so
+dictionary lookups and ``parse_entry`` never block the loop.
+"""
+
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import unquote
+
+try:
+    from aiohttp import web
+except ImportError:  # pragma: no cover - optional dependency
+    web = None
+
+
+def _make_environ(request, body):
+    raw_path = request.raw_path.split('?', 1)[0]
+    host, port = request.host, ''
+    if ':' in host:
+        host, port = host.rsplit(':', 1)
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        # same decoding as wsgiref: percent-decoded, latin-1 characters
+        'PATH_INFO': unquote(raw_path, 'iso-8859-1'),
+        'QUERY_STRING': request.query_string,
+        'SERVER_NAME': host,
+        'SERVER_PORT': port or ('443' if request.secure else '80'),
+        'SERVER_PROTOCOL': 'HTTP/%d.%d' % (request.version.major, request.version.minor),
+        'REMOTE_ADDR': request.remote or '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': request.scheme,
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in request.headers.items():
+        key = name.upper().replace('-', '_')
+        if key == 'CONTENT_TYPE' or key == 'CONTENT_LENGTH':
+            environ[key] = value
+        else:
+            key = 'HTTP_' + key
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+
+def _call_wsgi(app, environ):
+    """Run ``app`` until its status line is known (runs on the executor)."""
+    state = {'chunks': []}
+
+    def start_response(status, headers, exc_info=None):
+        state['status'] = status
+        state['headers'] = headers
+        return state['chunks'].append
+
+    result = app(environ, start_response)
+    if isinstance(result, (list, tuple)):
+        state['chunks'].extend(result)
+        return state, None
+    iterator = iter(result)
+    # a WSGI generator may only call start_response on its first iteration
+    for chunk in iterator:
+        state['chunks'].append(chunk)
+        if 'status' in state:
+            break
+    # 'next' is the executor future of the _next_chunk call in progress, if any
+    return state, {'result': result, 'iterator': iterator, 'next': None}
+
+
+def _next_chunk(iterator):
+    return next(iterator, None)
+
+
+def _close(result):
+    close = getattr(result, 'close', None)
+    if close is not None:
+        close()
+
+
+def _close_when_idle(pending):
+    """Close the WSGI iterable once no _next_chunk call is running on it (runs on the executor).
+
+    A send cancelled by a client disconnect leaves that call running on its
+    thread; closing a generator that is executing would raise ValueError and
+    skip the application's cleanup (admission slot, request tracker).
+    """
+    running = pending['next']
+    if running is not None:
+        wait([running])
+    _close(pending['result'])
+
+
+async def _send(request, status, headers, chunks, executor=None, pending=None):
+    code, _, reason = status.partition(' ')
+    response = web.StreamResponse(status=int(code), reason=reason or None)
+    for name, value in headers:
+        response.headers.add(name, value)
+    if pending is None and 'Content-Length' not in response.headers:
+        response.content_length = sum(len(c) for c in chunks)
+    await response.prepare(request)
+    if request.method != 'HEAD':
+        for chunk in chunks:
+            await response.write(chunk)
+        if pending is not None:
+            iterator = pending['iterator']
+            while True:
+                pending['next'] = executor.submit(_next_chunk, iterator)
+                chunk = await asyncio.wrap_future(pending['next'])
+                if chunk is None:
+                    break
+                await response.write(chunk)
+    await response.write_eof()
+    return response
+
+
+def make_app(wsgi_app, executor, cached_response=None):
+    """Wrap ``wsgi_app`` in an aiohttp application.
+
+    ``cached_response(environ)`` may return (status, headers, body chunks) for
+    requests that can be answered without touching the dictionary, or None.
+    """
+    if web is None:
+        raise RuntimeError('aiohttp is required for the async server. Please install aiohttp.')
+
+    async def handle(request):
+        body = await request.read()
+        environ = _make_environ(request, body)
+        if cached_response is not None and request.method == 'GET':
+            cached = cached_response(environ)
+            if cached is not None:
+                return await _send(request, *cached)
+        loop = asyncio.get_running_loop()
+        state, pending = await loop.run_in_executor(executor, _call_wsgi, wsgi_app, environ)
+        try:
+            return await _send(request, state['status'], state['headers'], state['chunks'],
+                               executor, pending)
+        finally:
+            if pending is not None:
+                await loop.run_in_executor(executor, _close_when_idle, pending)
+
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app.router.add_route('*', '/{tail:.*}', handle)
+    return app
+
+
+async def _serve(wsgi_app, host, port, workers, cached_response, keepalive_timeout):
+    executor = ThreadPoolExecutor(max_workers=workers)
+    runner = web.AppRunner(make_app(wsgi_app, executor, cached_response),
+                           keepalive_timeout=keepalive_timeout, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host or None, port)
+    await site.start()
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await runner.cleanup()
+        executor.shutdown(wait=False)
+
+
+def run_async_server(wsgi_app, host='', port=8888, workers=None, cached_response=None,
+                     keepalive_timeout=75.0):
+    """Serve ``wsgi_app`` on an asyncio event loop until interrupted."""
+    if web is None:
+        raise RuntimeError('aiohttp is required for the async server. Please install aiohttp.')
+    asyncio.run(_serve(wsgi_app, host, port, workers, cached_response, keepalive_timeout))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Compare the entry cache policies on a synthetic Zipf trace.
+
+Replays the same trace against LRUCacheBytes and TinyLFUCacheBytes (get,
+then set on a miss) and reports hit ratios, optionally with a one-off scan
+of rare words mixed in, and the throughput of cache hits across threads.
+
+Example:
+    python cache_benchmark.py --keys 100000 --requests 1000000 --skew 0.9 \
+        --cache-mb 16 --scan 0.2 --threads 8
+"""
+import argparse
+import random
+import threading
+import time
+from bisect import bisect_left
+
+from cache_util import TinyLFUCacheBytes
+from mdx_util import LRUCacheBytes
+
+
+POLICIES = (('lru', LRUCacheBytes), ('tinylfu', TinyLFUCacheBytes))
+
+
+def zipf_trace(keys, requests, skew, seed):
+    """Word ranks drawn with probability proportional to 1 / rank ** skew."""
+    rng = random.Random(seed)
+    cumulative = []
+    total = 0.0
+    for rank in range(1, keys + 1):
+        total += 1.0 / rank ** skew
+        cumulative.append(total)
+    return [bisect_left(cumulative, rng.random() * total) for _ in range(requests)]
+
+
+def with_scan(trace, keys, fraction):
+    """Insert a crawl of distinct never-repeated words, fraction of the trace long, in the middle."""
+    count = int(len(trace) * fraction)
+    middle = len(trace) // 2
+    return trace[:middle] + [keys + i for i in range(count)] + trace[middle:]
+
+
+def entry_sizes(keys, seed):
+    """Entry sizes in bytes, log-normal around 2 KB like parsed JSON entries."""
+    rng = random.Random(seed)
+    return [max(64, int(rng.lognormvariate(7.6, 0.8))) for _ in range(keys)]
+
+
+def replay(cache, trace, sizes, values):
+    hits = 0
+    for key in trace:
+        name = 'w%d' % key
+        if cache.get(name) is not None:
+            hits += 1
+        else:
+            cache.set(name, values[sizes[key % len(sizes)]])
+    return hits / len(trace)
+
+
+def hit_throughput(cache_class, max_bytes, threads, operations):
+    """Cache hits per second with threads all reading a small hot set."""
+    cache = cache_class(max_bytes=max_bytes)
+    names = ['w%d' % i for i in range(1000)]
+    for name in names:
+        cache.set(name, b'x' * 512)
+
+    def work():
+        get = cache.get
+        for i in range(operations):
+            get(names[i % 1000])
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return threads * operations / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare entry cache policies on a Zipf trace.")
+    parser.add_argument("--keys", type=int, default=100000, help="distinct words in the trace")
+    parser.add_argument("--requests", type=int, default=500000, help="length of the trace")
+    parser.add_argument("--skew", type=float, default=0.9, help="Zipf exponent")
+    parser.add_argument("--cache-mb", type=float, default=16, help="cache budget in MB")
+    parser.add_argument("--scan", type=float, default=0.2,
+                        help="length of a one-off crawl of rare words, as a fraction of the trace (0 for none)")
+    parser.add_argument("--threads", type=int, default=8, help="threads for the hit throughput test")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if args.keys <= 0 or args.requests <= 0 or args.cache_mb <= 0 or args.threads <= 0:
+        parser.error("keys, requests, cache-mb and threads must be positive")
+    max_bytes = int(args.cache_mb * 1024 * 1024)
+    sizes = entry_sizes(args.keys, args.seed)
+    values = {size: b'x' * size for size in set(sizes)}
+    trace = zipf_trace(args.keys, args.requests, args.skew, args.seed)
+    scenarios = [('zipf', trace)]
+    if args.scan > 0:
+        scenarios.append(('zipf+scan', with_scan(trace, args.keys, args.scan)))
+
+    print("Keys: {}  Requests: {}  Skew: {}  Cache: {} MB (~{:.1%} of the data)".format(
+        args.keys, args.requests, args.skew, args.cache_mb, max_bytes / sum(sizes)))
+    print("\n=== Hit ratio ===")
+    print("{:<12}".format('trace') + ''.join('{:>10}'.format(name) for name, _ in POLICIES))
+    for label, requests in scenarios:
+        ratios = [replay(cache_class(max_bytes=max_bytes), requests, sizes, values)
+                  for _, cache_class in POLICIES]
+        print("{:<12}".format(label) + ''.join('{:>10.2%}'.format(ratio) for ratio in ratios))
+
+    print("\n=== Cache hits/sec, {} threads ===".format(args.threads))
+    for name, cache_class in POLICIES:
+        print("{:<12}{:>12,.0f}".format(name, hit_throughput(cache_class, max_bytes, args.threads, 50000)))
+
+
+if __name__ == "__main__":
+    main()
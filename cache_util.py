@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Sharded byte-budget cache with a W-TinyLFU admission policy.
+
+Keys are spread over shards by hash, each with its own lock, so concurrent
+hits on different keys rarely wait for each other.  Every shard keeps a
+small LRU window for new entries and a segmented LRU (probation, protected)
+for the rest.  An entry leaving the window only displaces the main area's
+next victim if a count-min sketch of recent accesses says it is used more
+often, so a one-off crawl of rare words cannot flush the hot set.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+CACHE_SHARDS = 16
+# share of a shard's bytes for the admission window and, of the rest, for protected entries
+WINDOW_FRACTION = 0.01
+PROTECTED_FRACTION = 0.8
+# the sketch is sized for about one counter per this many bytes of budget
+SKETCH_BYTES_PER_ENTRY = 1024
+SKETCH_MIN_WIDTH = 1024
+SKETCH_MAX_WIDTH = 1 << 20
+SKETCH_DEPTH = 4  # _slots is unrolled for this depth
+# counters are halved after this many increments per counter, so old popularity fades
+SKETCH_SAMPLE_FACTOR = 10
+
+_HALVE = bytes(i >> 1 for i in range(256))
+_MASK64 = (1 << 64) - 1
+
+
+def _key_hash(key):
+    return hash(key) & _MASK64
+
+
+class CountMinSketch(object):
+    """Approximate access counts (saturating at 15) in SKETCH_DEPTH rows of byte counters."""
+
+    def __init__(self, width):
+        size = SKETCH_MIN_WIDTH
+        while size < min(width, SKETCH_MAX_WIDTH):
+            size <<= 1
+        self.width = size
+        self._mask = size - 1
+        self._table = bytearray(size * SKETCH_DEPTH)
+        self._additions = 0
+        self._sample_size = size * SKETCH_SAMPLE_FACTOR
+
+    def _slots(self, h):
+        # rows are SKETCH_DEPTH (4) consecutive tables, unrolled
+        width, mask = self.width, self._mask
+        h1, h2 = h & 0xffffffff, (h >> 32) | 1
+        return ((h1 & mask), width + ((h1 + h2) & mask),
+                2 * width + ((h1 + 2 * h2) & mask), 3 * width + ((h1 + 3 * h2) & mask))
+
+    def increment(self, h):
+        # _slots inlined: this runs on every cache get
+        table, width, mask = self._table, self.width, self._mask
+        h1, h2 = h & 0xffffffff, (h >> 32) | 1
+        a, b = h1 & mask, width + ((h1 + h2) & mask)
+        c, d = 2 * width + ((h1 + 2 * h2) & mask), 3 * width + ((h1 + 3 * h2) & mask)
+        if table[a] < 15:
+            table[a] += 1
+        if table[b] < 15:
+            table[b] += 1
+        if table[c] < 15:
+            table[c] += 1
+        if table[d] < 15:
+            table[d] += 1
+        self._additions += 1
+        if self._additions >= self._sample_size:
+            self._table = bytearray(table.translate(_HALVE))
+            self._additions //= 2
+
+    def estimate(self, h):
+        table = self._table
+        a, b, c, d = self._slots(h)
+        return min(table[a], table[b], table[c], table[d])
+
+
+class _Shard(object):
+    def __init__(self, max_bytes):
+        self.lock = threading.Lock()
+        self.window = OrderedDict()
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        self.window_bytes = 0
+        self.probation_bytes = 0
+        self.protected_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.sketch = CountMinSketch(max_bytes // SKETCH_BYTES_PER_ENTRY)
+        self.set_budget(max_bytes)
+
+    def set_budget(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.window_max = int(max_bytes * WINDOW_FRACTION)
+        self.protected_max = int((max_bytes - self.window_max) * PROTECTED_FRACTION)
+
+    @property
+    def current_bytes(self):
+        return self.window_bytes + self.probation_bytes + self.protected_bytes
+
+    def __len__(self):
+        return len(self.window) + len(self.probation) + len(self.protected)
+
+    def get(self, key, h):
+        with self.lock:
+            self.sketch.increment(h)
+            value = self.window.get(key)
+            if value is not None:
+                self.window.move_to_end(key)
+                self.hits += 1
+                return value
+            value = self.protected.get(key)
+            if value is not None:
+                self.protected.move_to_end(key)
+                self.hits += 1
+                return value
+            value = self.probation.pop(key, None)
+            if value is not None:
+                self._protect(key, value)
+                self.hits += 1
+                return value
+            self.misses += 1
+            return None
+
+    def _protect(self, key, value):
+        self.probation_bytes -= len(value)
+        self.protected[key] = value
+        self.protected_bytes += len(value)
+        while self.protected_bytes > self.protected_max and len(self.protected) > 1:
+            demoted, demoted_value = self.protected.popitem(last=False)
+            self.protected_bytes -= len(demoted_value)
+            self.probation[demoted] = demoted_value
+            self.probation_bytes += len(demoted_value)
+
+    def _discard(self, key):
+        for segment, attr in ((self.window, 'window_bytes'), (self.probation, 'probation_bytes'),
+                              (self.protected, 'protected_bytes')):
+            old = segment.pop(key, None)
+            if old is not None:
+                setattr(self, attr, getattr(self, attr) - len(old))
+                return
+
+    def set(self, key, value, h):
+        with self.lock:
+            self._discard(key)
+            self.sketch.increment(h)
+            self.window[key] = value
+            self.window_bytes += len(value)
+            while self.window_bytes > self.window_max and self.window:
+                candidate, candidate_value = self.window.popitem(last=False)
+                self.window_bytes -= len(candidate_value)
+                self._admit(candidate, candidate_value)
+
+    def _main_victim(self):
+        for segment in (self.probation, self.protected):
+            if segment:
+                return next(iter(segment)), segment
+        return None, None
+
+    def _admit(self, key, value):
+        """Move an entry out of the window into probation, if it is worth its victims."""
+        main_max = self.max_bytes - self.window_max
+        if len(value) > main_max:
+            self.evictions += 1
+            return
+        victim, segment = self._main_victim()
+        if self.probation_bytes + self.protected_bytes + len(value) > main_max and victim is not None:
+            if self.sketch.estimate(_key_hash(key)) <= self.sketch.estimate(_key_hash(victim)):
+                self.evictions += 1
+                return
+        while self.probation_bytes + self.protected_bytes + len(value) > main_max and victim is not None:
+            self._evict_main(victim, segment)
+            victim, segment = self._main_victim()
+        self.probation[key] = value
+        self.probation_bytes += len(value)
+
+    def _evict_main(self, victim, segment):
+        evicted = segment.pop(victim)
+        if segment is self.probation:
+            self.probation_bytes -= len(evicted)
+        else:
+            self.protected_bytes -= len(evicted)
+        self.evictions += 1
+
+    def shrink(self):
+        """Evict, least valuable first, until the shard is within its budget."""
+        while self.current_bytes > self.max_bytes:
+            victim, segment = self._main_victim()
+            if victim is not None:
+                self._evict_main(victim, segment)
+            elif self.window:
+                _, evicted = self.window.popitem(last=False)
+                self.window_bytes -= len(evicted)
+                self.evictions += 1
+            else:
+                break
+        while self.protected_bytes > self.protected_max and len(self.protected) > 1:
+            key, value = self.protected.popitem(last=False)
+            self.protected_bytes -= len(value)
+            self.probation[key] = value
+            self.probation_bytes += len(value)
+
+    def discard_matching(self, predicate):
+        removed = 0
+        with self.lock:
+            for segment, attr in ((self.window, 'window_bytes'), (self.probation, 'probation_bytes'),
+                                  (self.protected, 'protected_bytes')):
+                keys = [key for key in segment if predicate(key)]
+                for key in keys:
+                    setattr(self, attr, getattr(self, attr) - len(segment.pop(key)))
+                removed += len(keys)
+        return removed
+
+    def ranked_keys(self):
+        with self.lock:
+            keys = list(self.protected) + list(self.window) + list(self.probation)
+            return [(self.sketch.estimate(_key_hash(key)), key) for key in keys]
+
+
+class TinyLFUCacheBytes(object):
+    """Drop-in replacement for LRUCacheBytes: get/set of bytes values within max_bytes.
+
+    Values larger than a shard's budget (max_bytes / shards) are not cached.
+    """
+
+    def __init__(self, max_bytes=1024 * 1024 * 512, shards=CACHE_SHARDS):
+        self._shards = [_Shard(max_bytes // shards) for _ in range(shards)]
+        self._count = shards
+
+    def get(self, key):
+        h = hash(key) & _MASK64
+        return self._shards[(h >> 32) % self._count].get(key, h)
+
+    def set(self, key, value):
+        h = hash(key) & _MASK64
+        shard = self._shards[(h >> 32) % self._count]
+        if len(value) > shard.max_bytes:
+            return
+        shard.set(key, value, h)
+
+    @property
+    def max_bytes(self):
+        return sum(shard.max_bytes for shard in self._shards)
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes):
+        self.resize(max_bytes)
+
+    def resize(self, max_bytes):
+        """Change the budget, evicting at once if it shrank."""
+        for shard in self._shards:
+            with shard.lock:
+                shard.set_budget(max_bytes // len(self._shards))
+                shard.shrink()
+
+    @property
+    def current_bytes(self):
+        return sum(shard.current_bytes for shard in self._shards)
+
+    @property
+    def hits(self):
+        return sum(shard.hits for shard in self._shards)
+
+    @property
+    def misses(self):
+        return sum(shard.misses for shard in self._shards)
+
+    @property
+    def evictions(self):
+        return sum(shard.evictions for shard in self._shards)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def discard_matching(self, predicate):
+        """Remove every entry whose key satisfies predicate; returns the number removed."""
+        return sum(shard.discard_matching(predicate) for shard in self._shards)
+
+    def hottest_keys(self, limit):
+        """Up to limit keys, most frequently used first."""
+        ranked = []
+        for shard in self._shards:
+            ranked.extend(shard.ranked_keys())
+        ranked.sort(key=lambda item: -item[0])
+        return [key for _, key in ranked[:limit]]
+
+
+class NegativeCache(object):
+    """Bounded map of keys known to have no result, each forgotten ttl seconds after it was added.
+
+    ``get`` returns the value stored with a key (e.g. spelling suggestions),
+    or None if the key is unknown or expired.  max_entries of 0 disables it.
+    """
+
+    def __init__(self, max_entries=100000, ttl=600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()  # key -> (value, expiry), oldest first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] < time.time():
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.time() + self.ttl)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard_matching(self, predicate):
+        """Remove every entry whose key satisfies predicate; returns the number removed."""
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Second-tier cache of bytes values in an SQLite file.
+
+Reads run on the calling thread with a connection of its own.  Writes are
+queued and applied in batches by a background thread, so a lookup never
+waits for the disk; when the queue is full writes are dropped.  The file is
+in WAL mode: worker processes read it concurrently while one of them writes,
+and a read-only cache opened on a prebuilt file never writes at all.
+
+Entries carry an access time; once the file holds more than ``max_bytes``
+of values the least recently used are deleted.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from urllib.request import pathname2url
+
+from log_util import log
+
+
+DISK_CACHE_QUEUE_SIZE = 10000
+DISK_CACHE_BATCH_SIZE = 256
+# how often a writer re-reads the total size, which other processes change too
+DISK_CACHE_SIZE_CHECK_SECONDS = 30.0
+# evict down to this fraction of max_bytes, so eviction does not run on every batch
+DISK_CACHE_LOW_WATER = 0.9
+SQLITE_BUSY_TIMEOUT = 5.0
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    atime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime);
+'''
+
+
+class DiskCache(object):
+    def __init__(self, path, max_bytes, read_only=False):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.dropped = 0
+        self.current_bytes = 0
+        self.entries = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        if not read_only:
+            conn = self._connect()
+            try:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.executescript(_SCHEMA)
+                self._refresh_size(conn)
+            finally:
+                conn.close()
+
+    def __len__(self):
+        return self.entries
+
+    def _connect(self):
+        if self.read_only:
+            uri = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(self.path)))
+            return sqlite3.connect(uri, uri=True, timeout=SQLITE_BUSY_TIMEOUT)
+        return sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT)
+
+    def _reader(self):
+        # one connection per thread, reopened in a forked child
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.conn = self._connect()
+            local.pid = os.getpid()
+        return local.conn
+
+    def get(self, key):
+        try:
+            row = self._reader().execute('SELECT value FROM entries WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error:
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._submit(('touch', key, time.time()))
+        return bytes(row[0])
+
+    def set(self, key, value):
+        """Store value in the background; a no-op for a read-only cache or an oversized value."""
+        if len(value) <= self.max_bytes:
+            self._submit(('set', key, value))
+
+    def retain_prefix(self, prefix):
+        """Delete, in the background, every entry whose key does not start with prefix."""
+        self._submit(('retain', prefix, None))
+
+    def discard_matching(self, predicate):
+        """Delete, in the background, every entry whose key satisfies predicate."""
+        self._submit(('discard', predicate, None))
+
+    def _submit(self, op):
+        if self.read_only:
+            return
+        try:
+            self._writer_queue().put_nowait(op)
+        except queue.Full:
+            self.dropped += 1
+
+    def _writer_queue(self):
+        # (re)start the writer lazily: after a fork the child has no writer thread
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(DISK_CACHE_QUEUE_SIZE)
+                    threading.Thread(target=self._run, args=(self._queue,), name='disk-cache-writer',
+                                     daemon=True).start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def _run(self, q):
+        conn = self._connect()
+        checked = time.time()
+        while True:
+            batch = [q.get()]
+            while len(batch) < DISK_CACHE_BATCH_SIZE:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    self._apply(conn, batch)
+                    if time.time() - checked > DISK_CACHE_SIZE_CHECK_SECONDS:
+                        self._refresh_size(conn)
+                        checked = time.time()
+                    if self.current_bytes > self.max_bytes:
+                        self._refresh_size(conn)
+                        self._evict(conn)
+            except sqlite3.Error as e:
+                log.warning("disk cache write failed", path=self.path, error=str(e))
+
+    def _apply(self, conn, batch):
+        for op, arg, value in batch:
+            if op == 'set':
+                # a rewritten key replaces its old value: count only the difference
+                old = conn.execute('SELECT size FROM entries WHERE key = ?', (arg,)).fetchone()
+                conn.execute('INSERT OR REPLACE INTO entries (key, value, size, atime) VALUES (?, ?, ?, ?)',
+                             (arg, value, len(value), time.time()))
+                if old is None:
+                    self.current_bytes += len(value)
+                    self.entries += 1
+                else:
+                    self.current_bytes += len(value) - old[0]
+            elif op == 'touch':
+                conn.execute('UPDATE entries SET atime = ? WHERE key = ?', (value, arg))
+            elif op == 'retain':
+                conn.execute('DELETE FROM entries WHERE substr(key, 1, ?) != ?', (len(arg), arg))
+                self._refresh_size(conn)
+            elif op == 'discard':
+                keys = [(key,) for key, in conn.execute('SELECT key FROM entries') if arg(key)]
+                conn.executemany('DELETE FROM entries WHERE key = ?', keys)
+                self._refresh_size(conn)
+
+    def _refresh_size(self, conn):
+        count, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        self.entries, self.current_bytes = count, total
+
+    def _evict(self, conn):
+        excess = self.current_bytes - int(self.max_bytes * DISK_CACHE_LOW_WATER)
+        victims = []
+        for key, size in conn.execute('SELECT key, size FROM entries ORDER BY atime'):
+            if excess <= 0:
+                break
+            victims.append((key,))
+            excess -= size
+        conn.executemany('DELETE FROM entries WHERE key = ?', victims)
+        self.evictions += len(victims)
+        self._refresh_size(conn)
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-# version: python 3.5
+# version: python 3.7
 import os
 import io
 
@@ -43,6 +43,21 @@ def file_util_read_byte(path):
     return rst_bytes
 
 
+def file_util_iter_byte(path, start=0, stop=None, chunk_size=64 * 1024):
+    """分块读取二进制文件 [start, stop) 区间"""
+    with io.open(path, 'br') as f:
+        f.seek(start)
+        remaining = None if stop is None else stop - start
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            data = f.read(size)
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            yield data
+
+
 def file_util_get_ext(path):
     """得到文件后缀（不包含点）"""
     return os.path.splitext(path)[1][1:]
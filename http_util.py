@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""HTTP validators, conditional requests (ETag / Last-Modified / 304), byte ranges
+and content encoding negotiation."""
+
+import gzip
+import hashlib
+import io
+from email.utils import formatdate, parsedate_to_datetime
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+
+# MDD media never changes for a given dictionary file; let browsers and CDNs keep it
+MEDIA_CACHE_CONTROL = 'public, max-age=2592000'  # 30 days
+
+# bodies are written in pieces of this size instead of one large copy
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# requested_range() result for a range that starts past the end of the body
+RANGE_NOT_SATISFIABLE = 'unsatisfiable'
+
+# bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 256
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 6
+
+
+def make_etag(*parts):
+    """Strong ETag derived from the given identity parts."""
+    digest = hashlib.sha1('\0'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+    return '"' + digest[:32] + '"'
+
+
+def http_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+
+def parse_http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def _etag_matches(header, etag):
+    if header.strip() == '*':
+        return True
+    # If-None-Match uses the weak comparison function
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def is_not_modified(environ, etag=None, last_modified=None):
+    """True if the request's validators show the client already has this response.
+
+    If-None-Match takes precedence over If-Modified-Since (RFC 7232 section 6).
+    """
+    if environ.get('REQUEST_METHOD', 'GET') not in ('GET', 'HEAD'):
+        return False
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        return etag is not None and _etag_matches(if_none_match, etag)
+    if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since and last_modified is not None:
+        since = parse_http_date(if_modified_since)
+        return since is not None and int(last_modified) <= since
+    return False
+
+
+def validator_headers(etag=None, last_modified=None, cache_control=None):
+    headers = []
+    if etag is not None:
+        headers.append(('ETag', etag))
+    if last_modified is not None:
+        headers.append(('Last-Modified', http_date(last_modified)))
+    if cache_control is not None:
+        headers.append(('Cache-Control', cache_control))
+    return headers
+
+
+def _if_range_matches(value, etag, last_modified):
+    value = value.strip()
+    if value.startswith('"') or value.startswith('W/'):
+        # If-Range requires the strong comparison function
+        return etag is not None and not value.startswith('W/') and value == etag
+    since = parse_http_date(value)
+    return since is not None and last_modified is not None and int(last_modified) == since
+
+
+def requested_range(environ, length, etag=None, last_modified=None):
+    """Return the (start, stop) byte range to send, None for the whole body,
+    or RANGE_NOT_SATISFIABLE.
+
+    Only a single range is honoured; multiple ranges and malformed headers
+    are answered with the whole body, as RFC 7233 allows.
+    """
+    header = environ.get('HTTP_RANGE')
+    if not header or environ.get('REQUEST_METHOD', 'GET') != 'GET':
+        return None
+    if_range = environ.get('HTTP_IF_RANGE')
+    if if_range and not _if_range_matches(if_range, etag, last_modified):
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                return RANGE_NOT_SATISFIABLE if suffix == 0 else None
+            return max(0, length - suffix), length
+        start = int(first)
+        stop = int(last) + 1 if last else length
+    except ValueError:
+        return None
+    if start < 0 or (last and stop <= start):
+        return None
+    if start >= length:
+        return RANGE_NOT_SATISFIABLE
+    return start, min(stop, length)
+
+
+def range_response(length, byte_range):
+    """Return (status, headers) for a body of ``length`` bytes and a requested_range() result."""
+    headers = [('Accept-Ranges', 'bytes')]
+    if byte_range == RANGE_NOT_SATISFIABLE:
+        headers.append(('Content-Range', 'bytes */{}'.format(length)))
+        headers.append(('Content-Length', '0'))
+        return '416 Range Not Satisfiable', headers
+    if byte_range is None:
+        headers.append(('Content-Length', str(length)))
+        return '200 OK', headers
+    start, stop = byte_range
+    headers.append(('Content-Range', 'bytes {}-{}/{}'.format(start, stop - 1, length)))
+    headers.append(('Content-Length', str(stop - start)))
+    return '206 Partial Content', headers
+
+
+def iter_bytes(data, start=0, stop=None, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield data[start:stop] in chunks without copying the whole slice first."""
+    view = memoryview(data)
+    if stop is None:
+        stop = len(view)
+    for pos in range(start, stop, chunk_size):
+        yield bytes(view[pos:min(pos + chunk_size, stop)])
+
+
+def _accepted_codings(header):
+    codings = {}
+    for item in header.split(','):
+        name, _, params = item.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[name] = q
+    return codings
+
+
+def accepted_encoding(environ):
+    """Pick 'br' (when brotli is installed) or 'gzip' from Accept-Encoding, or None."""
+    header = environ.get('HTTP_ACCEPT_ENCODING')
+    if not header:
+        return None
+    codings = _accepted_codings(header)
+    wildcard = codings.get('*', 0.0)
+    candidates = ['gzip'] if brotli is None else ['br', 'gzip']
+    best, best_q = None, 0.0
+    for name in candidates:
+        q = codings.get(name, wildcard)
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def compress_body(data, encoding):
+    if encoding == 'gzip':
+        # gzip.compress() only takes mtime from Python 3.8; a fixed mtime keeps bodies and ETags stable
+        buf = io.BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=GZIP_LEVEL, mtime=0) as f:
+            f.write(data)
+        return buf.getvalue()
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    raise ValueError("unsupported content encoding: {}".format(encoding))
+
+
+def encoding_headers(encoding):
+    headers = [('Vary', 'Accept-Encoding')]
+    if encoding is not None:
+        headers.append(('Content-Encoding', encoding))
+    return headers
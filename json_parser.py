@@ -1,4 +1,5 @@
 import json
+import re
 from urllib.parse import urlparse
 
 try:
@@ -455,6 +456,33 @@ def _parse_forms(section):
     return forms
 
 
+_FORM_BLOCK_RE = re.compile(r'<(res-g|if-gs-blk)\b.*?</\1>', re.S)
+# syllable dots and stress marks inside forms: mean·er -> meaner
+_FORM_MARK_RE = re.compile(r'\s*[\u00b7\u02c8\u02cc\u2027]\s*')
+_FORM_SPLIT_RE = re.compile(r'\s*(?:[,/;()]|\bor\b)\s*')
+
+
+def extract_inflections(html, headword=None):
+    """Inflected forms listed in an entry ("means", "meaning", "meaner"), lower case, without headword.
+
+    Only the form blocks are parsed, so this is cheap enough for an index-time
+    pass over every entry.  Returns [] without bs4.
+    """
+    if BeautifulSoup is None:
+        return []
+    skip = headword.lower() if headword else None
+    forms = []
+    for block in _FORM_BLOCK_RE.finditer(html):
+        for form in _parse_forms(BeautifulSoup(block.group(0), 'html.parser')):
+            values = form['value'] if isinstance(form['value'], list) else [form['value']]
+            for value in values:
+                for part in _FORM_SPLIT_RE.split(_FORM_MARK_RE.sub('', value)):
+                    part = part.strip().lower()
+                    if part and part != skip and ' ' not in part:
+                        forms.append(part)
+    return list(dict.fromkeys(forms))
+
+
 def _parse_idioms(block):
     idioms = []
     if not block:
@@ -1,7 +1,18 @@
 # -*- coding: utf-8 -*-
 # version: python 3.x
+"""Lemmatizers used when a word is not a headword.
+
+A lemmatizer returns candidate base forms of a word, most likely first; the
+caller looks them up in the dictionary until one is found.  The default,
+from get_lemmatizer(), uses pattern.en when it is installed, then English
+suffix rules, with an LRU memo in front.  set_lemmatizer() plugs in another.
+
+Command line: python lemma.py word
+"""
 
 import sys
+import threading
+from collections import OrderedDict
 
 try:
     from pattern.en import lemma as pattern_lemma
@@ -9,18 +20,195 @@ except Exception:
     pattern_lemma = None
 
 
+LEMMA_MEMO_SIZE = 65536
+
+VOWELS = set('aeiou')
+
+# common irregular forms the suffix rules cannot derive
+IRREGULAR = {
+    'am': 'be', 'is': 'be', 'are': 'be', 'was': 'be', 'were': 'be', 'been': 'be',
+    'has': 'have', 'had': 'have', 'does': 'do', 'did': 'do', 'done': 'do',
+    'went': 'go', 'gone': 'go', 'said': 'say', 'made': 'make', 'took': 'take', 'taken': 'take',
+    'came': 'come', 'saw': 'see', 'seen': 'see', 'knew': 'know', 'known': 'know', 'got': 'get',
+    'gotten': 'get', 'gave': 'give', 'given': 'give', 'found': 'find', 'thought': 'think',
+    'told': 'tell', 'became': 'become', 'left': 'leave', 'felt': 'feel', 'brought': 'bring',
+    'began': 'begin', 'begun': 'begin', 'kept': 'keep', 'held': 'hold', 'wrote': 'write',
+    'written': 'write', 'stood': 'stand', 'heard': 'hear', 'meant': 'mean', 'met': 'meet',
+    'ran': 'run', 'paid': 'pay', 'sat': 'sit', 'spoke': 'speak', 'spoken': 'speak', 'led': 'lead',
+    'grew': 'grow', 'grown': 'grow', 'lost': 'lose', 'fell': 'fall', 'fallen': 'fall', 'sent': 'send',
+    'built': 'build', 'understood': 'understand', 'drew': 'draw', 'drawn': 'draw', 'broke': 'break',
+    'broken': 'break', 'spent': 'spend', 'rose': 'rise', 'risen': 'rise', 'drove': 'drive',
+    'driven': 'drive', 'bought': 'buy', 'wore': 'wear', 'worn': 'wear', 'chose': 'choose',
+    'chosen': 'choose', 'ate': 'eat', 'eaten': 'eat', 'flew': 'fly', 'flown': 'fly', 'sang': 'sing',
+    'sung': 'sing', 'swam': 'swim', 'swum': 'swim', 'threw': 'throw', 'thrown': 'throw',
+    'caught': 'catch', 'taught': 'teach', 'fought': 'fight', 'sold': 'sell', 'slept': 'sleep',
+    'won': 'win', 'forgot': 'forget', 'forgotten': 'forget', 'hid': 'hide', 'hidden': 'hide',
+    'bit': 'bite', 'bitten': 'bite', 'rode': 'ride', 'ridden': 'ride', 'woke': 'wake', 'woken': 'wake',
+    'men': 'man', 'women': 'woman', 'children': 'child', 'feet': 'foot', 'teeth': 'tooth',
+    'geese': 'goose', 'mice': 'mouse', 'people': 'person', 'oxen': 'ox',
+    'better': 'good', 'best': 'good', 'worse': 'bad', 'worst': 'bad',
+}
+
+
+def _doubled(stem):
+    """stopp -> stop: a doubled final consonant added before -ed/-ing/-er/-est."""
+    return len(stem) > 2 and stem[-1] == stem[-2] and stem[-1] not in VOWELS and stem[-1] not in 'lsz'
+
+
+def _short_cvc(stem):
+    """hop, tap: stems that would have doubled their consonant, so hoped is more likely hope."""
+    return (len(stem) >= 3 and stem[-1] not in VOWELS and stem[-1] not in 'wxy'
+            and stem[-2] in VOWELS and stem[-3] not in VOWELS)
+
+
+def _suffix_stems(stem):
+    if _doubled(stem):
+        return [stem[:-1], stem]
+    if _short_cvc(stem):
+        return [stem + 'e', stem]
+    return [stem, stem + 'e']
+
+
+class RuleLemmatizer(object):
+    """English inflections stripped by suffix rules: plurals, -ed, -ing, -er, -est, -ly."""
+
+    def candidates(self, word):
+        w = word.lower()
+        if w in IRREGULAR:
+            return [IRREGULAR[w]]
+        if w.endswith("'s"):
+            w = w[:-2]
+            return [w] + [c for c in self.candidates(w) if c != w]
+        result = []
+        if w.endswith('ies') and len(w) > 4:
+            result += [w[:-3] + 'y', w[:-1]]
+        elif w.endswith('ves') and len(w) > 4:
+            result += [w[:-3] + 'f', w[:-3] + 'fe', w[:-1]]
+        elif w.endswith('es') and len(w) > 3:
+            if w[:-2].endswith(('s', 'x', 'z', 'ch', 'sh', 'o')):
+                result += [w[:-2], w[:-1]]
+            else:
+                result += [w[:-1], w[:-2]]
+        elif w.endswith('s') and not w.endswith(('ss', 'us', 'is')) and len(w) > 3:
+            result.append(w[:-1])
+        elif w.endswith('ied') and len(w) > 4:
+            result += [w[:-3] + 'y', w[:-1]]
+        elif w.endswith('ed') and len(w) > 4:
+            result += _suffix_stems(w[:-2])
+        elif w.endswith('ying') and len(w) > 4:
+            result += [w[:-4] + 'ie', w[:-3]]
+        elif w.endswith('ing') and len(w) > 5:
+            result += _suffix_stems(w[:-3])
+        elif w.endswith('iest') and len(w) > 5:
+            result.append(w[:-4] + 'y')
+        elif w.endswith('est') and len(w) > 5:
+            result += _suffix_stems(w[:-3])
+        elif w.endswith('ier') and len(w) > 4:
+            result.append(w[:-3] + 'y')
+        elif w.endswith('er') and len(w) > 4:
+            result += _suffix_stems(w[:-2])
+        elif w.endswith('ily') and len(w) > 4:
+            result.append(w[:-3] + 'y')
+        elif w.endswith('ly') and len(w) > 4:
+            result.append(w[:-2])
+        return [c for c in dict.fromkeys(result) if len(c) > 1 and c != w]
+
+
+class PatternLemmatizer(object):
+    """pattern.en's lemma(), for verbs and the irregular forms it knows."""
+
+    def __init__(self):
+        if pattern_lemma is None:
+            raise ImportError("pattern.en is not installed")
+        self._lock = threading.Lock()  # pattern loads its lexicon lazily and is not thread safe
+
+    def candidates(self, word):
+        try:
+            with self._lock:
+                lemma_word = pattern_lemma(word)
+        except Exception:
+            return []
+        return [lemma_word] if lemma_word and lemma_word != word else []
+
+
+class ChainLemmatizer(object):
+    """Candidates of several lemmatizers, in order, without duplicates."""
+
+    def __init__(self, *lemmatizers):
+        self.lemmatizers = lemmatizers
+
+    def candidates(self, word):
+        result = []
+        for lemmatizer in self.lemmatizers:
+            result.extend(lemmatizer.candidates(word))
+        return list(dict.fromkeys(result))
+
+
+class MemoLemmatizer(object):
+    """LRU memo in front of a lemmatizer; lemmatize_many serves the batch and warm-up paths."""
+
+    def __init__(self, lemmatizer, size=LEMMA_MEMO_SIZE):
+        self.lemmatizer = lemmatizer
+        self.size = size
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+
+    def candidates(self, word):
+        with self._lock:
+            result = self._memo.get(word)
+            if result is not None:
+                self._memo.move_to_end(word)
+                return result
+        result = tuple(self.lemmatizer.candidates(word))
+        with self._lock:
+            self._memo[word] = result
+            while len(self._memo) > self.size:
+                self._memo.popitem(last=False)
+        return result
+
+    def lemmatize_many(self, words):
+        """Map each word to its candidates."""
+        return {word: self.candidates(word) for word in dict.fromkeys(words)}
+
+
+def default_lemmatizer():
+    if pattern_lemma is not None:
+        return MemoLemmatizer(ChainLemmatizer(PatternLemmatizer(), RuleLemmatizer()))
+    return MemoLemmatizer(RuleLemmatizer())
+
+
+_lemmatizer = None
+_lemmatizer_lock = threading.Lock()
+
+
+def get_lemmatizer():
+    global _lemmatizer
+    if _lemmatizer is None:
+        with _lemmatizer_lock:
+            if _lemmatizer is None:
+                _lemmatizer = default_lemmatizer()
+    return _lemmatizer
+
+
+def set_lemmatizer(lemmatizer):
+    """Use lemmatizer (anything with candidates(word)) from now on; it is wrapped in a memo."""
+    global _lemmatizer
+    if not isinstance(lemmatizer, MemoLemmatizer):
+        lemmatizer = MemoLemmatizer(lemmatizer)
+    _lemmatizer = lemmatizer
+
+
+def lemma(word):
+    """The most likely base form of word, or word itself."""
+    candidates = get_lemmatizer().candidates(word)
+    return candidates[0] if candidates else word
+
+
 def main():
     if len(sys.argv) < 2:
         print("lemma.py word")
         return
-    word = sys.argv[1]
-    if pattern_lemma is None:
-        print(word)
-        return
-    try:
-        print(pattern_lemma(word))
-    except Exception:
-        print(word)
+    print(lemma(sys.argv[1]))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Structured logging written off the request path.
+
+Log records are JSON lines handed to a background thread through a bounded
+queue and written in batches, so request threads never wait on stdout or a
+log file.  When the queue is full records are dropped and counted.
+"""
+
+import atexit
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40, 'off': 100}
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 512
+LOG_FLUSH_SECONDS = 0.5
+
+
+class BufferedLogWriter(object):
+    """Write lines to a stream from a background thread, many lines per write call."""
+
+    def __init__(self, stream, queue_size=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_SECONDS):
+        self.stream = stream
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._pid = None
+        self._queue = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # (re)start the writer lazily: after a fork the child has no writer thread
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(self.queue_size)
+                    threading.Thread(target=self._run, args=(self._queue,), name='log-writer',
+                                     daemon=True).start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def write(self, line):
+        try:
+            self._ensure_thread().put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self, q, first):
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch):
+        try:
+            self.stream.write(''.join(batch))
+            self.stream.flush()
+        except (OSError, ValueError):
+            pass
+
+    def _run(self, q):
+        while True:
+            try:
+                first = q.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._write_batch(self._drain(q, first))
+
+    def flush(self):
+        """Write whatever is queued from the calling thread (used at exit)."""
+        q = self._queue
+        if q is None or self._pid != os.getpid():
+            return
+        while True:
+            try:
+                first = q.get_nowait()
+            except queue.Empty:
+                return
+            self._write_batch(self._drain(q, first))
+
+
+class Logger(object):
+    """Leveled JSON-lines logger; access records are sampled at ``sample_rate``."""
+
+    def __init__(self, writer, level=INFO, sample_rate=1.0):
+        self.writer = writer
+        self.level = level
+        self.sample_rate = sample_rate
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def _emit(self, record):
+        self.writer.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+
+    def log(self, level, message, **fields):
+        if level < self.level:
+            return
+        record = {'ts': round(time.time(), 3), 'level': _level_name(level), 'msg': message}
+        record.update(fields)
+        self._emit(record)
+
+    def debug(self, message, **fields):
+        self.log(DEBUG, message, **fields)
+
+    def info(self, message, **fields):
+        self.log(INFO, message, **fields)
+
+    def warning(self, message, **fields):
+        self.log(WARNING, message, **fields)
+
+    def error(self, message, **fields):
+        self.log(ERROR, message, **fields)
+
+    def access_enabled(self, status):
+        """True if a request with this status should be written to the access log.
+
+        Access records are logged at info level; server errors are never sampled out.
+        """
+        if INFO < self.level:
+            return False
+        return self.sample_rate >= 1.0 or status >= 500 or random.random() < self.sample_rate
+
+    def access(self, fields):
+        record = {'ts': round(time.time(), 3)}
+        record.update(fields)
+        self._emit(record)
+
+
+def _level_name(level):
+    for name, value in LEVELS.items():
+        if value == level:
+            return name
+    return str(level)
+
+
+def _open_stream(path):
+    if not path or path == '-':
+        return sys.stdout
+    return open(path, 'a', encoding='utf-8')
+
+
+log = Logger(BufferedLogWriter(sys.stdout))
+atexit.register(lambda: log.writer.flush())
+
+
+def configure(level='info', path='-', sample_rate=1.0):
+    """Set the level ('debug'..'error' or 'off'), destination ('-' for stdout) and access sampling."""
+    log.writer.flush()
+    log.writer = BufferedLogWriter(_open_stream(path))
+    log.level = LEVELS[level]
+    log.sample_rate = sample_rate
+    return log
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-# version: python 3.5
+# version: python 3.7
 
 
 from readmdict import MDX, MDD
@@ -11,6 +11,10 @@ import os
 import glob
 import sqlite3
 import json
+import mmap
+import threading
+import time
+from urllib.request import pathname2url
 
 # zlib compression is used for engine version >=2.0
 import zlib
@@ -21,7 +25,10 @@ except ImportError:
     lzo = None
     #print("LZO compression support is not available")
 
-from multi_file_reader import open_binary
+from multi_file_reader import open_binary, MappedFileReader
+from metrics_util import INDEX_BUILD_SECONDS, observe_stage
+from log_util import log
+import json_parser
 
 # 2x3 compatible
 if sys.hexversion >= 0x03000000:
@@ -29,12 +36,26 @@ if sys.hexversion >= 0x03000000:
 
 version = '1.1'
 
+# host parameters per statement; SQLite builds before 3.32 allow at most 999
+SQL_VARIABLE_LIMIT = 500
+# bump when extract_inflections changes, to refill INFLECTION in existing index files
+INFLECTION_VERSION = '1'
+
 
 class IndexBuilder(object):
     #todo: enable history
-    def __init__(self, fname, encoding = "", passcode = None, force_rebuild = False, enable_history = False, sql_index = True, check = False):
+    def __init__(self, fname, encoding = "", passcode = None, force_rebuild = False, enable_history = False, sql_index = True, check = False, read_only = False, use_mmap = False):
         self._mdx_file = fname
         self._mdd_file = ""
+        # sqlite connections and file handles are opened lazily per thread (and per process)
+        self._local = threading.local()
+        # lookups open the index databases read-only and read dictionaries through
+        # one mmap per process (shared page cache across pre-forked workers)
+        self._read_only = read_only
+        self._use_mmap = use_mmap
+        self._mmaps = {}
+        self._mmaps_lock = threading.Lock()
+        self._identity = None
         self._encoding = ''
         self._stylesheet = {}
         self._title = ''
@@ -86,6 +107,14 @@ class IndexBuilder(object):
             for cc in cursor:
                 self._description = cc[1]
 
+            cursor = conn.execute("SELECT * FROM META WHERE key = \"inflection\"")
+            inflection_version = None
+            for cc in cursor:
+                inflection_version = cc[1]
+            if inflection_version != INFLECTION_VERSION:
+                self._upgrade_inflection_index(conn)
+            conn.close()
+
             #for cc in cursor:
             #    if cc[0] == 'encoding':
             #        self._encoding = cc[1]
@@ -131,9 +160,7 @@ class IndexBuilder(object):
                 mdd_paths.append(path)
         for path in mdd_paths:
             db_path = path + ".db"
-            if force_rebuild and os.path.isfile(db_path):
-                os.remove(db_path)
-            if not os.path.isfile(db_path):
+            if force_rebuild or not os.path.isfile(db_path):
                 self._make_mdd_index(path, db_path)
             self._mdd_infos.append({'file': path, 'db': db_path})
 
@@ -146,6 +173,27 @@ class IndexBuilder(object):
             self._mdd_db = ""
     
 
+    def get_mdx_db(self):
+        """Path of the SQLite index built for the mdx file."""
+        return self._mdx_db
+
+    def get_mdx_file(self):
+        return self._mdx_file
+
+    def get_identity(self):
+        """[(path, size, mtime), ...] of the mdx file and every mdd file, taken on first call."""
+        if self._identity is None:
+            self._identity = self.stat_identity()
+        return self._identity
+
+    def stat_identity(self):
+        """Like get_identity(), but stat the files now; raises OSError if one is missing."""
+        identity = []
+        for path in [self._mdx_file] + [info['file'] for info in self._mdd_infos]:
+            st = os.stat(path)
+            identity.append((os.path.abspath(path), st.st_size, int(st.st_mtime)))
+        return identity
+
     def _replace_stylesheet(self, txt):
         # substitute stylesheet definition
         txt_list = re.split('`\d+`', txt)
@@ -160,13 +208,17 @@ class IndexBuilder(object):
         return txt_styled
 
     def _make_mdx_index(self, db_name):
-        if os.path.exists(db_name):
-            os.remove(db_name)
+        # build into a temporary file and move it over the old index when complete,
+        # so readers of the old index (a server being reloaded) never see a partial one
+        started = time.perf_counter()
+        tmp_name = db_name + '.tmp'
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
         mdx = MDX(self._mdx_file)
         self._mdx_db = db_name
         returned_index = mdx.get_index(check_block = self._check)
         index_list = returned_index['index_dict_list']
-        conn = sqlite3.connect(db_name)
+        conn = sqlite3.connect(tmp_name)
         c = conn.cursor()
         c.execute(
             ''' CREATE TABLE MDX_INDEX
@@ -226,20 +278,69 @@ class IndexBuilder(object):
                 '''
                 )
 
-        conn.commit()
-        conn.close()
         #set class member
         self._encoding = meta['encoding']
         self._stylesheet = json.loads(meta['stylesheet'])
         self._title = meta['title']
         self._description = meta['description']
+        conn.commit()
+        INDEX_BUILD_SECONDS.observe(time.perf_counter() - started, 'mdx')
+        self._make_inflection_index(conn)
+        conn.commit()
+        conn.close()
+        os.replace(tmp_name, db_name)
+
+    def _upgrade_inflection_index(self, conn):
+        # index files from before the table existed get it added in place; a read-only
+        # index (prefork workers, a read-only filesystem) waits for the next rebuild
+        if self._read_only:
+            log.warning("index has no current inflection table; open it once read-write (e.g. without "
+                        "--mode prefork) or delete it to add the table", db=self._mdx_db)
+            return
+        try:
+            with conn:
+                self._make_inflection_index(conn)
+        except sqlite3.Error as e:
+            log.warning("inflection table not built", db=self._mdx_db, error=str(e))
+
+    def _make_inflection_index(self, conn):
+        """Fill the INFLECTION table (form_text -> key_text) from the forms every entry lists.
+
+        Without bs4 the table is left out; inflection lookups then find nothing.
+        """
+        if json_parser.BeautifulSoup is None:
+            return
+        started = time.perf_counter()
+        log.info("building inflection table", mdx=self._mdx_file)
+        rows = []
+        with open(self._mdx_file, 'rb') as mdx_file:
+            for key_text, record in self._iter_records(conn, mdx_file):
+                for form in json_parser.extract_inflections(record, key_text):
+                    rows.append((form, key_text))
+        c = conn.cursor()
+        c.execute('DROP TABLE IF EXISTS INFLECTION')
+        c.execute(
+            ''' CREATE TABLE INFLECTION
+               (form_text text not null,
+                key_text text not null
+                )'''
+        )
+        c.executemany('INSERT INTO INFLECTION VALUES (?,?)', rows)
+        c.execute('CREATE INDEX inflection_index ON INFLECTION (form_text)')
+        c.execute('DELETE FROM META WHERE key = "inflection"')
+        c.execute('INSERT INTO META VALUES (?,?)', ('inflection', INFLECTION_VERSION))
+        seconds = time.perf_counter() - started
+        INDEX_BUILD_SECONDS.observe(seconds, 'inflection')
+        log.info("inflection table built", mdx=self._mdx_file, forms=len(rows), seconds=round(seconds, 3))
 
     def _make_mdd_index(self, mdd_path, db_name):
-        if os.path.exists(db_name):
-            os.remove(db_name)
+        started = time.perf_counter()
+        tmp_name = db_name + '.tmp'
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
         mdd = MDD(mdd_path)
         index_list = mdd.get_index(check_block = self._check)
-        conn = sqlite3.connect(db_name)
+        conn = sqlite3.connect(tmp_name)
         c = conn.cursor()
         c.execute(
             ''' CREATE TABLE MDX_INDEX
@@ -277,8 +378,10 @@ class IndexBuilder(object):
 
         conn.commit()
         conn.close()
+        os.replace(tmp_name, db_name)
+        INDEX_BUILD_SECONDS.observe(time.perf_counter() - started, 'mdd')
 
-    def get_mdx_by_index(self, fmdx, index):
+    def _decompress_record_block(self, fmdx, index):
         fmdx.seek(index['file_pos'])
         record_block_compressed = fmdx.read(index['compressed_size'])
         record_block_type = record_block_compressed[:4]
@@ -298,6 +401,9 @@ class IndexBuilder(object):
         elif record_block_type == 2:
             # decompress
             _record_block = zlib.decompress(record_block_compressed[8:])
+        return _record_block
+
+    def _decode_mdx_record(self, _record_block, index):
         record = _record_block[index['record_start'] - index['offset']:index['record_end'] - index['offset']]
         record = record = record.decode(self._encoding, errors='ignore').strip(u'\x00').encode('utf-8')
         if self._stylesheet:
@@ -305,75 +411,214 @@ class IndexBuilder(object):
         record = record.decode('utf-8')
         return record
 
-    def get_mdd_by_index(self, fmdx, index):
-        fmdx.seek(index['file_pos'])
-        record_block_compressed = fmdx.read(index['compressed_size'])
-        record_block_type = record_block_compressed[:4]
-        record_block_type = index['record_block_type']
-        decompressed_size = index['decompressed_size']
-        #adler32 = unpack('>I', record_block_compressed[4:8])[0]
-        if record_block_type == 0:
-            _record_block = record_block_compressed[8:]
-            # lzo compression
-        elif record_block_type == 1:
-            if lzo is None:
-                print("LZO compression is not supported")
-                # decompress
-            header = b'\xf0' + pack('>I', index['decompressed_size'])
-            _record_block = lzo.decompress(record_block_compressed[8:], initSize = decompressed_size, blockSize=1308672)
-                # zlib compression
-        elif record_block_type == 2:
-            # decompress
-            _record_block = zlib.decompress(record_block_compressed[8:])
-        data = _record_block[index['record_start'] - index['offset']:index['record_end'] - index['offset']]        
+    def get_mdx_by_index(self, fmdx, index):
+        _record_block = self._decompress_record_block(fmdx, index)
+        return self._decode_mdx_record(_record_block, index)
+
+    def get_mdd_by_index(self, fmdx, index, view=False):
+        _record_block = self._decompress_record_block(fmdx, index)
+        start = index['record_start'] - index['offset']
+        end = index['record_end'] - index['offset']
+        if view:
+            # a window on the decompressed block, no copy of the resource
+            return memoryview(_record_block)[start:end]
+        data = _record_block[start:end]
         return data
 
-    def _rows_to_lookup(self, cursor, data_file, fetcher):
+    def _row_to_index(self, result):
+        index = {}
+        index['file_pos'] = result[1]
+        index['compressed_size'] = result[2]
+        index['decompressed_size'] = result[3]
+        index['record_block_type'] = result[4]
+        index['record_start'] = result[5]
+        index['record_end'] = result[6]
+        index['offset'] = result[7]
+        return index
+
+    def _query(self, conn, sql, params):
+        started = time.perf_counter()
+        rows = conn.execute(sql, params).fetchall()
+        observe_stage('sqlite', time.perf_counter() - started)
+        return rows
+
+    def _rows_to_lookup(self, rows, data_file, fetcher):
+        if not rows:
+            return []
+        started = time.perf_counter()
         lookup_result_list = []
-        for result in cursor:
-            index = {}
-            index['file_pos'] = result[1]
-            index['compressed_size'] = result[2]
-            index['decompressed_size'] = result[3]
-            index['record_block_type'] = result[4]
-            index['record_start'] = result[5]
-            index['record_end'] = result[6]
-            index['offset'] = result[7]
-            lookup_result_list.append(fetcher(data_file, index))
+        for result in rows:
+            lookup_result_list.append(fetcher(data_file, self._row_to_index(result)))
+        observe_stage('decompress', time.perf_counter() - started)
         return lookup_result_list
 
+    def _thread_handles(self):
+        # handles must not be shared between threads, and must not survive a fork
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.pid = os.getpid()
+            local.mdx = None
+            local.mdd = {}
+        return local
+
+    def _connect(self, db_path, check_same_thread=True):
+        if self._read_only:
+            return sqlite3.connect('file:{}?mode=ro'.format(pathname2url(os.path.abspath(db_path))), uri=True,
+                                   check_same_thread=check_same_thread)
+        return sqlite3.connect(db_path, check_same_thread=check_same_thread)
+
+    def _open_data(self, source):
+        if not self._use_mmap or isinstance(source, (list, tuple)):
+            return open_binary(source)
+        # mappings are read-only and stay valid in forked children
+        with self._mmaps_lock:
+            mapping = self._mmaps.get(source)
+            if mapping is None:
+                with open(source, 'rb') as f:
+                    mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._mmaps[source] = mapping
+        return MappedFileReader(mapping, source)
+
+    def _mdx_handles(self):
+        local = self._thread_handles()
+        if local.mdx is None:
+            local.mdx = (self._connect(self._mdx_db), self._open_data(self._mdx_file))
+        return local.mdx
+
+    def _mdd_handles(self, info):
+        local = self._thread_handles()
+        handles = local.mdd.get(info['db'])
+        if handles is None:
+            handles = (self._connect(info['db']), self._open_data(info['file']))
+            local.mdd[info['db']] = handles
+        return handles
+
+    def map_files(self):
+        """Map the dictionary files now, e.g. in a parent process before forking workers."""
+        if not self._use_mmap:
+            return
+        self._open_data(self._mdx_file)
+        for info in self._mdd_infos:
+            self._open_data(info['file'])
+
+    def close(self):
+        """Close the sqlite connections and files opened by the calling thread."""
+        local = self._thread_handles()
+        handles = list(local.mdd.values())
+        if local.mdx is not None:
+            handles.append(local.mdx)
+        local.mdx = None
+        local.mdd = {}
+        for conn, data_file in handles:
+            data_file.close()
+            conn.close()
+
     def mdx_lookup(self, keyword):
-        conn = sqlite3.connect(self._mdx_db)
-        mdx_file = open(self._mdx_file,'rb')
+        conn, mdx_file = self._mdx_handles()
+        rows = self._query(conn, "SELECT * FROM MDX_INDEX WHERE key_text = ?", (keyword,))
+        return self._rows_to_lookup(rows, mdx_file, self.get_mdx_by_index)
+	
+    def mdx_lookup_many(self, keywords):
+        """Look up many keywords at once; returns {keyword: [record, ...]} for those found.
+
+        All keys are resolved with indexed IN queries and the hits are read in
+        file order, so each record block is decompressed once however many of
+        the keywords it holds.
+        """
+        conn, mdx_file = self._mdx_handles()
+        keywords = list(dict.fromkeys(keywords))
+        rows = []
+        for i in range(0, len(keywords), SQL_VARIABLE_LIMIT):
+            chunk = keywords[i:i + SQL_VARIABLE_LIMIT]
+            rows.extend(self._query(conn, "SELECT * FROM MDX_INDEX WHERE key_text IN ({})".format(','.join('?' * len(chunk))), chunk))
+        rows.sort(key=lambda row: (row[1], row[5]))
+        started = time.perf_counter()
+        results = {}
+        block_pos = None
+        _record_block = None
+        for row in rows:
+            index = self._row_to_index(row)
+            if index['file_pos'] != block_pos:
+                _record_block = self._decompress_record_block(mdx_file, index)
+                block_pos = index['file_pos']
+            results.setdefault(row[0], []).append(self._decode_mdx_record(_record_block, index))
+        if rows:
+            observe_stage('decompress', time.perf_counter() - started)
+        return results
+
+    def iter_mdx_records(self):
+        """Yield (key_text, record) for every MDX entry in file order.
+
+        Each record block is decompressed once and only one block is held in
+        memory at a time.  The generator owns its connection and file handle,
+        so it may be resumed from any thread.
+        """
+        conn = self._connect(self._mdx_db, check_same_thread=False)
+        mdx_file = open(self._mdx_file, 'rb')
         try:
-            cursor = conn.execute("SELECT * FROM MDX_INDEX WHERE key_text = ?", (keyword,))
-            lookup_result_list = self._rows_to_lookup(cursor, mdx_file, self.get_mdx_by_index)
+            for item in self._iter_records(conn, mdx_file):
+                yield item
         finally:
             mdx_file.close()
             conn.close()
-        return lookup_result_list
-	
-    def mdd_lookup(self, keyword):
+
+    def _iter_records(self, conn, mdx_file):
+        cursor = conn.execute("SELECT * FROM MDX_INDEX ORDER BY file_pos, record_start")
+        block_pos = None
+        _record_block = None
+        for row in cursor:
+            index = self._row_to_index(row)
+            if index['file_pos'] != block_pos:
+                _record_block = self._decompress_record_block(mdx_file, index)
+                block_pos = index['file_pos']
+            yield row[0], self._decode_mdx_record(_record_block, index)
+
+    def lookup_inflections(self, word):
+        """Headwords listing word as one of their inflected forms, e.g. "mean" for "meant"."""
+        return self.lookup_inflections_many([word]).get(word, [])
+
+    def lookup_inflections_many(self, words):
+        """Map each of words that is an inflected form to its headwords, with indexed IN queries."""
+        conn, _ = self._mdx_handles()
+        forms = {}
+        for word in words:
+            forms.setdefault(word.lower(), []).append(word)
+        keys = list(forms)
+        results = {}
+        for i in range(0, len(keys), SQL_VARIABLE_LIMIT):
+            chunk = keys[i:i + SQL_VARIABLE_LIMIT]
+            try:
+                rows = self._query(conn, "SELECT form_text, key_text FROM INFLECTION WHERE form_text IN ({}) ORDER BY rowid".format(','.join('?' * len(chunk))), chunk)
+            except sqlite3.OperationalError:
+                # an index file without the table, opened read-only
+                return {}
+            for form_text, key_text in rows:
+                for word in forms[form_text]:
+                    headwords = results.setdefault(word, [])
+                    if key_text not in headwords:
+                        headwords.append(key_text)
+        return results
+
+    def mdd_lookup(self, keyword, view=False):
+        """Return the matching MDD resources; with view=True as memoryviews on the decompressed blocks."""
         if not self._mdd_infos:
             return []
+        fetcher = self.get_mdd_by_index
+        if view:
+            fetcher = lambda data_file, index: self.get_mdd_by_index(data_file, index, view=True)
         for info in self._mdd_infos:
-            conn = sqlite3.connect(info['db'])
-            mdd_file = open_binary(info['file'])
-            try:
-                for candidate in self._candidate_mdd_keys(keyword):
-                    cursor = conn.execute("SELECT * FROM MDX_INDEX WHERE key_text = ? COLLATE NOCASE", (candidate,))
-                    lookup_result_list = self._rows_to_lookup(cursor, mdd_file, self.get_mdd_by_index)
-                    if lookup_result_list:
-                        return lookup_result_list
-                suffix = self._mdd_suffix(keyword)
-                if suffix:
-                    cursor = conn.execute("SELECT * FROM MDX_INDEX WHERE key_text LIKE ? COLLATE NOCASE", ('%' + suffix,))
-                    lookup_result_list = self._rows_to_lookup(cursor, mdd_file, self.get_mdd_by_index)
-                    if lookup_result_list:
-                        return lookup_result_list
-            finally:
-                mdd_file.close()
-                conn.close()
+            conn, mdd_file = self._mdd_handles(info)
+            for candidate in self._candidate_mdd_keys(keyword):
+                rows = self._query(conn, "SELECT * FROM MDX_INDEX WHERE key_text = ? COLLATE NOCASE", (candidate,))
+                lookup_result_list = self._rows_to_lookup(rows, mdd_file, fetcher)
+                if lookup_result_list:
+                    return lookup_result_list
+            suffix = self._mdd_suffix(keyword)
+            if suffix:
+                rows = self._query(conn, "SELECT * FROM MDX_INDEX WHERE key_text LIKE ? COLLATE NOCASE", ('%' + suffix,))
+                lookup_result_list = self._rows_to_lookup(rows, mdd_file, fetcher)
+                if lookup_result_list:
+                    return lookup_result_list
         return []
 
     def _candidate_mdd_keys(self, keyword):
@@ -451,7 +696,7 @@ class IndexBuilder(object):
                 query = query.replace('*','%')
             else:
                 query = query + '%'
-            cursor = conn.execute('SELECT key_text FROM MDX_INDEX WHERE key_text LIKE \"' + query + '\"')
+            cursor = conn.execute('SELECT key_text FROM MDX_INDEX WHERE key_text LIKE ?', (query,))
             keys = [item[0] for item in cursor]
         else:
             cursor = conn.execute('SELECT key_text FROM MDX_INDEX')
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Export a whole MDX dictionary as newline-delimited JSON, one entry per line.
+
+Example:
+    python mdx_export.py /path/to/dictionary.mdx -o dictionary.ndjson
+"""
+import argparse
+import os
+import sys
+
+from mdict_query import IndexBuilder
+from mdx_util import iter_export_ndjson
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export an MDX dictionary as NDJSON.")
+    parser.add_argument("filename", help="mdx file name")
+    parser.add_argument("-o", "--output", default="-",
+                        help="output file, default stdout")
+    parser.add_argument("--media-prefix", default=None,
+                        help="rewrite audio/image URLs under this prefix, e.g. /api/dic")
+    args = parser.parse_args()
+    if not os.path.isfile(args.filename):
+        parser.error("Please specify a valid MDX file")
+    builder = IndexBuilder(args.filename)
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        for chunk in iter_export_ndjson(builder, args.media_prefix):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+        else:
+            out.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,39 @@
 # -*- coding: utf-8 -*-
-# version: python 3.5
+# version: python 3.7
 
 import threading
 import re
 import os
+import signal
 import sys
-from urllib.parse import unquote
+import json
+import time
+import traceback
+import hmac
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, quote, unquote
 
 
-from wsgiref.simple_server import make_server
 from file_util import *
 from mdx_util import *
 from mdict_query import IndexBuilder
+from server_pool import SERVER_MODES, QuietWSGIRequestHandler, default_workers, make_pooled_server
+from aio_server import run_async_server
+from prefork import serve_prefork
+from resource_util import ResourceDirectory, find_resource_path
+from http_util import MEDIA_CACHE_CONTROL, MIN_COMPRESS_BYTES, RANGE_NOT_SATISFIABLE, accepted_encoding, \
+    compress_body, encoding_headers, is_not_modified, iter_bytes, make_etag, range_response, \
+    requested_range, validator_headers
+from json_parser import to_json_bytes
+from suggest_util import DEFAULT_SUGGEST_LIMIT, PrefixIndex
+from reload_util import FileWatcher, RequestTracker
+from metrics_util import CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, REQUESTS, REQUEST_SECONDS, \
+    CallbackMetric, end_trace, start_trace
+from log_util import LEVELS, configure as configure_logging, log
+from admission_util import RETRY_AFTER_SECONDS, AdmissionController, default_limits
+from warmup_util import WarmUp, load_warmup_words
+from lemma import get_lemmatizer
 
 """
 browser URL:
@@ -38,80 +60,781 @@ content_type_map = {
     'woff2': 'application/font-woff2',
 }
 
-try:
-    base_path = os.path.dirname(sys.executable)
-except Exception:
-    base_path = os.path.abspath(".")
-
-resource_path = os.path.join(base_path, 'mdx')
-if not os.path.isdir(resource_path):
-    resource_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mdx')
+resource_path = find_resource_path()
 print("resouce path : " + resource_path)
 builder = None
+# name -> IndexBuilder for every loaded dictionary; builder is the first one and is also served at /
+dictionaries = OrderedDict()
+# dictionary names that would shadow a fixed /api/ route
+RESERVED_NAMES = ('admin', 'all', 'batch', 'dic', 'entry', 'export', 'suggest')
+# IndexBuilder options used for the initial load, reused when a dictionary is reloaded
+load_options = {}
+# in-flight requests, so a reload can wait for those still using a replaced dictionary
+request_tracker = RequestTracker()
+reload_lock = threading.Lock()
+# prefork workers leave index rebuilds to the supervisor process
+reload_via_supervisor = False
+# bounds concurrent dictionary lookups (cache hits and static files bypass it); None admits everything
+admission = None
+# thread pool for /api/all/entry/ fan-out, created on first use (after any fork)
+fanout_executor = None
+fanout_lock = threading.Lock()
+# (builder, in-memory headword array) for /api/suggest, rebuilt when builder is replaced
+suggest_index = None
+suggest_lock = threading.Lock()
+# startup cache warm-up; /ready answers 503 until it is far enough along
+warmup = None
+# largest /api/batch request body accepted
+BATCH_MAX_BODY_BYTES = 1024 * 1024
+# largest admin request body (a cache dump being restored) and default dump size
+ADMIN_MAX_BODY_BYTES = 64 * 1024 * 1024
+CACHE_DUMP_LIMIT = 10000
+CACHE_RESTORE_SECONDS = 300.0
+# the last POST /api/admin/cache/restore, running in the background
+cache_restore = None
+# shared secret the admin API requires in X-Admin-Token (--admin-token); None disables the API
+admin_token = None
+# route table of mdx/, built once; small files such as O8C.css are kept in memory
+static_resources = ResourceDirectory(resource_path, content_type_map)
 
 
 def get_url_map():
-    result = {}
-    files = []
-
-    # resource_path = '/mdx'
-    file_util_get_files(resource_path, files)
-    for p in files:
-        if file_util_get_ext(p) in content_type_map:
-            p = p.replace('\\', '/')
-            result[re.match('.*?/mdx(/.*)', p).groups()[0]] = p
-    return result
+    return static_resources.url_map()
+
+
+# JSON API route prefix -> media prefix used when rewriting audio/image URLs
+api_json_routes = (
+    ('/api/dic/', '/api/dic'),
+    ('/api/entry/', None),
+)
+
+
+def dictionary_prefix(name):
+    """URL prefix of a named dictionary's pages and media."""
+    return '/d/' + quote(name)
+
+
+def _api_route(path_info):
+    """Return (route prefix, media prefix, word, builder) for a JSON entry URL, or None.
+
+    /api/dic/ and /api/entry/ serve the default dictionary, /api/<name>/entry/ a named one.
+    """
+    for prefix, media_prefix in api_json_routes:
+        if path_info.startswith(prefix):
+            return prefix, media_prefix, unquote(path_info[len(prefix):]), builder
+    if path_info.startswith('/api/'):
+        name, sep, rest = path_info[len('/api/'):].partition('/')
+        if sep and rest.startswith('entry/') and name in dictionaries:
+            return ('/api/{}/entry/'.format(name), dictionary_prefix(name),
+                    unquote(rest[len('entry/'):]), dictionaries[name])
+    return None
+
+
+def _json_validators(prefix, word, encoding=None, dict_builder=None):
+    fingerprint, last_modified = dictionary_fingerprint(dict_builder)
+    return make_etag(fingerprint, prefix, word, encoding), last_modified
+
+
+def cached_api_response(environ):
+    """Answer an API request from its validators or json_cache alone.
+
+    Returns (status, headers, body chunks), or None if the request needs a
+    dictionary lookup.
+    """
+    started = time.perf_counter()
+    trace = start_trace()
+    try:
+        response = _cached_api_response(environ)
+    finally:
+        end_trace()
+    if response is not None:
+        # answered on the event loop without application(): count and log it the same way
+        seconds = time.perf_counter() - started
+        status = int(response[0][:3])
+        REQUESTS.inc('api_entry', response[0][:3])
+        REQUEST_SECONDS.observe(seconds, 'api_entry')
+        if log.access_enabled(status):
+            sent = sum(len(chunk) for chunk in response[2])
+            log.access(_access_record(environ, 'api_entry', status, sent, seconds, trace))
+    return response
+
+
+def _cached_api_response(environ):
+    try:
+        path_info = environ['PATH_INFO'].encode('iso8859-1').decode('utf-8')
+    except UnicodeError:
+        return None
+    route = _api_route(path_info)
+    if route is None:
+        return None
+    prefix, media_prefix, api_word, dict_builder = route
+    environ['mdx.word'] = api_word
+    encoding = accepted_encoding(environ)
+    etag, last_modified = _json_validators(prefix, api_word, encoding, dict_builder)
+    validators = validator_headers(etag, last_modified)
+    if is_not_modified(environ, etag, last_modified):
+        return '304 Not Modified', validators + encoding_headers(None), []
+    # compressing is left to the executor
+    cached = get_cached_definition_json(api_word, dict_builder, media_prefix, encoding, compress=False)
+    if cached is None:
+        return None
+    chunks, applied = cached
+    headers = [('Content-Type', 'application/json; charset=utf-8')] + validators + encoding_headers(applied)
+    return '200 OK', headers, chunks
+
+
+def _json_error(start_response, status, message, headers=None):
+    start_response(status, [('Content-Type', 'application/json; charset=utf-8')] + (headers or []))
+    return [to_json_bytes({'error': message})]
+
+
+def _admit(environ):
+    """Take an admission slot for a request about to do a dictionary lookup; False to shed it.
+
+    The slot is released by application() once the response has been sent.
+    """
+    if admission is None:
+        return True
+    if not admission.acquire():
+        return False
+    environ['mdx.admitted'] = True
+    return True
+
+
+def _overloaded(start_response):
+    return _json_error(start_response, '503 Service Unavailable', 'server busy, retry later',
+                       [('Retry-After', str(RETRY_AFTER_SECONDS))])
+
+
+def register_admission_metrics():
+    for name, kind, documentation, read in (
+            ('mdx_admission_running', 'gauge', 'Dictionary lookups running.', lambda: admission.running),
+            ('mdx_admission_waiting', 'gauge', 'Dictionary lookups waiting for a slot.', lambda: admission.waiting),
+            ('mdx_admission_limit', 'gauge', 'Maximum concurrent dictionary lookups.', lambda: admission.limit),
+            ('mdx_admission_rejected_total', 'counter', 'Requests shed with 503.', lambda: admission.rejected)):
+        REGISTRY.register(CallbackMetric(name, documentation, kind, (), lambda read=read: [((), read())]))
+
+
+def warm_word(word):
+    """Fill json_cache for word the way the entry routes would, in every dictionary."""
+    # the encoding a browser gets, so the HTML page is cached in the variant most requested
+    encoding = accepted_encoding({'HTTP_ACCEPT_ENCODING': 'gzip, deflate, br'})
+    for name, d in list(dictionaries.items()):
+        if d is builder:
+            for _, media_prefix in api_json_routes:
+                get_definition_json_encoded(word, d, media_prefix, encoding)
+            get_definition_mdx_encoded(word, d, encoding)
+        else:
+            prefix = dictionary_prefix(name)
+            get_definition_json_encoded(word, d, prefix, encoding)
+            get_definition_mdx_encoded(word, d, encoding, prefix)
+
+
+def start_warmup(paths, top, workers, max_seconds, max_mb, threshold, background=True):
+    global warmup
+    words = load_warmup_words(paths, top)
+    warmup = WarmUp(words, warm_word, lambda: json_cache.current_bytes, max_mb * 1024 * 1024,
+                    workers=workers, max_seconds=max_seconds, threshold=threshold)
+    REGISTRY.register(CallbackMetric(
+        'mdx_warmup_words', 'Words of the startup warm-up list by state.', 'gauge', ('state',),
+        lambda: [(('warmed',), warmup.done), (('failed',), warmup.failed), (('total',), warmup.total)]))
+    print("warming the cache with {} words...".format(len(words)))
+    if background:
+        threading.Thread(target=_run_warmup, daemon=True).start()
+    else:
+        _run_warmup()
+
+
+def _run_warmup():
+    started = time.time()
+    # one call fills the lemma memo for the words the warm-up will miss
+    get_lemmatizer().lemmatize_many(warmup.words)
+    status = warmup.run()
+    print("cache warm-up stopped ({}): {} of {} words in {:.1f}s, {} MB cached".format(
+        status['stop_reason'], status['warmed'], status['total'], time.time() - started,
+        json_cache.current_bytes // (1024 * 1024)))
+
+
+def _ready_response(environ, start_response):
+    """GET /ready: 200 once dictionaries are loaded and warm-up is past its threshold, else 503."""
+    status = warmup.status() if warmup is not None else {'ready': True}
+    if builder is None:
+        status['ready'] = False
+    start_response('200 OK' if status['ready'] else '503 Service Unavailable',
+                   [('Content-Type', 'application/json; charset=utf-8'), ('Cache-Control', 'no-store')])
+    return [to_json_bytes(status)]
+
+
+def _batch_response(environ, start_response):
+    """POST /api/batch with {"words": [...]} (or a bare list): one JSON map word -> entry."""
+    if environ.get('REQUEST_METHOD') != 'POST':
+        return _json_error(start_response, '405 Method Not Allowed', 'POST required', [('Allow', 'POST')])
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    if length > BATCH_MAX_BODY_BYTES:
+        return _json_error(start_response, '413 Payload Too Large', 'request body too large')
+    try:
+        payload = json.loads(environ['wsgi.input'].read(length).decode('utf-8'))
+    except (UnicodeError, ValueError):
+        return _json_error(start_response, '400 Bad Request', 'invalid JSON body')
+    words = payload.get('words') if isinstance(payload, dict) else payload
+    if not isinstance(words, list) or not all(isinstance(w, str) and w for w in words):
+        return _json_error(start_response, '400 Bad Request', 'words must be a list of non-empty strings')
+    if len(words) > BATCH_MAX_WORDS:
+        return _json_error(start_response, '400 Bad Request',
+                           'at most {} words per batch'.format(BATCH_MAX_WORDS))
+    if not _admit(environ):
+        return _overloaded(start_response)
+    body = get_definitions_batch(words, builder)
+    encoding = accepted_encoding(environ)
+    if encoding is not None and len(body) >= MIN_COMPRESS_BYTES:
+        body = compress_body(body, encoding)
+    else:
+        encoding = None
+    start_response('200 OK', [('Content-Type', 'application/json; charset=utf-8')] + encoding_headers(encoding))
+    return [body]
+
+
+def get_suggest_index():
+    global suggest_index
+    current = builder
+    entry = suggest_index
+    if entry is None or entry[0] is not current:
+        with suggest_lock:
+            if suggest_index is None or suggest_index[0] is not current:
+                suggest_index = (current, PrefixIndex.from_builder(current))
+            entry = suggest_index
+    return entry[1]
+
+
+def _suggest_response(environ, start_response):
+    """GET /api/suggest?prefix=..&limit=..: headwords starting with prefix, ignoring case."""
+    query = parse_qs(environ.get('QUERY_STRING', ''))
+    prefix = query.get('prefix', [''])[0]
+    try:
+        limit = int(query.get('limit', [DEFAULT_SUGGEST_LIMIT])[0])
+    except ValueError:
+        return _json_error(start_response, '400 Bad Request', 'limit must be an integer')
+    if builder is None:
+        return _json_error(start_response, '503 Service Unavailable', 'no dictionary loaded')
+    words = get_suggest_index().suggest(prefix, limit)
+    start_response('200 OK', [('Content-Type', 'application/json; charset=utf-8')])
+    return [to_json_bytes({'prefix': prefix, 'words': words})]
+
+
+def get_fanout_executor():
+    global fanout_executor
+    if fanout_executor is None:
+        with fanout_lock:
+            if fanout_executor is None:
+                fanout_executor = ThreadPoolExecutor(max_workers=max(1, len(dictionaries)))
+    return fanout_executor
+
+
+def _all_entry_response(environ, start_response, word):
+    """GET /api/all/entry/<word>: {"<name>": <entry JSON>, ...} from every dictionary, looked up concurrently."""
+    if not word:
+        return _json_error(start_response, '400 Bad Request', 'word required')
+    encoding = accepted_encoding(environ)
+    stamps = [dictionary_fingerprint(d) for d in dictionaries.values()]
+    etag = make_etag('all', word, encoding, *[fingerprint for fingerprint, _ in stamps])
+    last_modified = max([last for _, last in stamps if last is not None] or [None])
+    validators = validator_headers(etag, last_modified)
+    if is_not_modified(environ, etag, last_modified):
+        start_response('304 Not Modified', validators + encoding_headers(None))
+        return []
+    if not _admit(environ):
+        return _overloaded(start_response)
+    media_prefixes = dict((name, dictionary_prefix(name)) for name in dictionaries)
+    body = get_definitions_all(word, dictionaries, get_fanout_executor(), media_prefixes)
+    if encoding is not None and len(body) >= MIN_COMPRESS_BYTES:
+        body = compress_body(body, encoding)
+    else:
+        encoding = None
+    start_response('200 OK', [('Content-Type', 'application/json; charset=utf-8')]
+                   + validators + encoding_headers(encoding))
+    return [body]
+
+
+def _send_ranged(environ, start_response, headers, length, chunks, etag=None, last_modified=None):
+    """Send a body of ``length`` bytes honouring Range; chunks(start, stop) yields the bytes."""
+    byte_range = requested_range(environ, length, etag, last_modified)
+    status, range_headers = range_response(length, byte_range)
+    start_response(status, headers + range_headers)
+    if byte_range == RANGE_NOT_SATISFIABLE:
+        return []
+    start, stop = byte_range or (0, length)
+    return chunks(start, stop)
+
+
+ADMIN_FORBIDDEN = 'admin API needs --admin-token, a matching X-Admin-Token header and a request from localhost'
+
+
+def _admin_allowed(environ):
+    # loopback alone is not enough: behind a reverse proxy every client comes from localhost
+    if not admin_token or environ.get('REMOTE_ADDR') not in ('127.0.0.1', '::1'):
+        return False
+    return hmac.compare_digest(environ.get('HTTP_X_ADMIN_TOKEN', '').encode('utf-8'), admin_token.encode('utf-8'))
+
+
+def _read_json_body(environ, max_bytes):
+    """Return the decoded JSON request body, or None if it is invalid or longer than max_bytes."""
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return None
+    if length > max_bytes:
+        return None
+    try:
+        return json.loads(environ['wsgi.input'].read(length).decode('utf-8'))
+    except (UnicodeError, ValueError):
+        return None
+
+
+def _reload_response(environ, start_response):
+    """POST /api/admin/reload (admin token, loopback only): reload changed dictionaries in the background."""
+    if environ.get('REQUEST_METHOD') != 'POST':
+        return _json_error(start_response, '405 Method Not Allowed', 'POST required', [('Allow', 'POST')])
+    if not _admin_allowed(environ):
+        return _json_error(start_response, '403 Forbidden', ADMIN_FORBIDDEN)
+    trigger_reload()
+    start_response('202 Accepted', [('Content-Type', 'application/json; charset=utf-8')])
+    return [to_json_bytes({'status': 'reloading'})]
+
+
+def dump_cache_entries(limit):
+    """Describe the hottest json_cache entries of the loaded dictionaries, for /api/admin/cache/restore."""
+    names = {dictionary_fingerprint(d)[0]: name for name, d in dictionaries.items()}
+    digest = injection_digest()
+    entries = []
+    for key in json_cache.hottest_keys(limit):
+        parts = parse_cache_key(key)
+        if parts is None or parts['version'] != CACHE_VERSION or parts['fingerprint'] not in names:
+            continue
+        if parts['kind'] == 'html' and parts['digest'] != digest:
+            continue
+        entries.append({'dictionary': names[parts['fingerprint']], 'kind': parts['kind'],
+                        'prefix': parts['prefix'], 'word': parts['word'], 'encoding': parts['encoding']})
+    return entries
+
+
+def restore_cache_entry(entry):
+    """Recompute one entry described by dump_cache_entries."""
+    d = dictionaries.get(entry.get('dictionary'))
+    word = entry.get('word')
+    encoding = entry.get('encoding')
+    if d is None or not isinstance(word, str) or not word or encoding not in (None, 'gzip', 'br'):
+        raise ValueError("not a cache entry of a loaded dictionary: {!r}".format(entry))
+    if entry.get('kind') == 'html':
+        get_definition_mdx_encoded(word, d, encoding, entry.get('prefix') or '')
+    else:
+        get_definition_json_encoded(word, d, entry.get('prefix'), encoding)
+
+
+def _cache_admin_response(environ, start_response, action):
+    """/api/admin/cache[/dump|/purge|/resize|/restore] (admin token, loopback only): inspect and tune json_cache.
+
+    The cache belongs to the process serving the request: in prefork mode
+    each worker has its own.
+    """
+    global cache_restore
+    if not _admin_allowed(environ):
+        return _json_error(start_response, '403 Forbidden', ADMIN_FORBIDDEN)
+    method = environ.get('REQUEST_METHOD')
+    if action in ('', '/dump'):
+        if method != 'GET':
+            return _json_error(start_response, '405 Method Not Allowed', 'GET required', [('Allow', 'GET')])
+        if action == '':
+            body = {'pid': os.getpid(), 'caches': cache_stats()}
+            if cache_restore is not None:
+                body['restore'] = cache_restore.status()
+        else:
+            try:
+                limit = int(parse_qs(environ.get('QUERY_STRING', '')).get('limit', [CACHE_DUMP_LIMIT])[0])
+            except ValueError:
+                return _json_error(start_response, '400 Bad Request', 'limit must be an integer')
+            body = {'version': CACHE_VERSION, 'entries': dump_cache_entries(max(0, limit))}
+        start_response('200 OK', [('Content-Type', 'application/json; charset=utf-8'), ('Cache-Control', 'no-store')])
+        return [to_json_bytes(body)]
+    if action not in ('/purge', '/resize', '/restore'):
+        return _json_error(start_response, '404 Not Found', 'unknown cache action')
+    if method != 'POST':
+        return _json_error(start_response, '405 Method Not Allowed', 'POST required', [('Allow', 'POST')])
+    payload = _read_json_body(environ, ADMIN_MAX_BODY_BYTES)
+    if not isinstance(payload, dict):
+        return _json_error(start_response, '400 Bad Request', 'invalid JSON body')
+    status = '200 OK'
+    if action == '/purge':
+        selectors = {name: payload[name] for name in ('word', 'prefix', 'version')
+                     if isinstance(payload.get(name), str) and payload[name]}
+        if (len(selectors) == 1) == (payload.get('all') is True):
+            return _json_error(start_response, '400 Bad Request',
+                               'give one of "word", "prefix" or "version", or "all": true')
+        body = {'purged': purge_cache(**selectors)}
+    elif action == '/resize':
+        max_mb = payload.get('max_mb')
+        if not isinstance(max_mb, int) or isinstance(max_mb, bool) or max_mb <= 0:
+            return _json_error(start_response, '400 Bad Request', 'max_mb must be a positive integer')
+        json_cache.resize(max_mb * 1024 * 1024)
+        body = {'max_bytes': json_cache.max_bytes, 'bytes': json_cache.current_bytes}
+    else:
+        entries = payload.get('entries')
+        if not isinstance(entries, list) or not all(isinstance(e, dict) for e in entries):
+            return _json_error(start_response, '400 Bad Request', 'entries must be a list of objects')
+        if cache_restore is not None and not cache_restore.finished:
+            return _json_error(start_response, '409 Conflict', 'a restore is already running')
+        cache_restore = WarmUp(entries, restore_cache_entry, lambda: json_cache.current_bytes,
+                               json_cache.max_bytes, max_seconds=CACHE_RESTORE_SECONDS).start()
+        status, body = '202 Accepted', {'restoring': len(entries)}
+    start_response(status, [('Content-Type', 'application/json; charset=utf-8')])
+    return [to_json_bytes(body)]
+
+
+def _close_after(result, finish):
+    """Iterate a WSGI result and call finish(bytes sent) once it is exhausted or closed."""
+    sent = 0
+    try:
+        for chunk in result:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        close = getattr(result, 'close', None)
+        if close is not None:
+            close()
+        finish(sent)
+
+
+def _access_record(environ, route, status, sent, seconds, trace):
+    record = {
+        'method': environ.get('REQUEST_METHOD'),
+        'path': environ.get('PATH_INFO'),
+        'route': route,
+        'status': status,
+        'bytes': sent,
+        'ms': round(seconds * 1000, 3),
+        'remote': environ.get('REMOTE_ADDR'),
+    }
+    if 'mdx.word' in environ:
+        record['word'] = environ['mdx.word']
+    if trace is not None:
+        if trace['stages']:
+            record['stages'] = dict((k, round(v * 1000, 3)) for k, v in trace['stages'].items())
+        if trace['cache'] is not None:
+            record['cache'] = trace['cache']
+    return record
 
 
 def application(environ, start_response):
+    started = time.perf_counter()
+    # count the request until its body is sent, so reloads can drain it
+    generation = request_tracker.begin()
+    response = {}
+    trace = start_trace()
+
+    def start(status, headers, exc_info=None):
+        response['status'] = status
+        return start_response(status, headers, exc_info)
+
+    def finish(sent):
+        if environ.pop('mdx.admitted', False):
+            admission.release()
+        request_tracker.end(generation)
+        seconds = time.perf_counter() - started
+        route = environ.get('mdx.route', 'other')
+        status = response.get('status', '500')[:3]
+        REQUESTS.inc(route, status)
+        REQUEST_SECONDS.observe(seconds, route)
+        if log.access_enabled(int(status)):
+            log.access(_access_record(environ, route, int(status), sent, seconds, trace))
+
+    try:
+        result = dispatch(environ, start)
+    except BaseException:
+        end_trace()
+        finish(0)
+        raise
+    # stages of a streamed body run later, possibly on another thread: not traced
+    end_trace()
+    if isinstance(result, list):
+        finish(sum(len(chunk) for chunk in result))
+        return result
+    return _close_after(result, finish)
+
+
+def dispatch(environ, start_response):
     path_info = environ['PATH_INFO'].encode('iso8859-1').decode('utf-8')
-    print(path_info)
     m = re.match('/(.*)', path_info)
     word = ''
     if m is not None:
         word = m.groups()[0]
 
-    if path_info.startswith('/api/dic/'):
-        api_word = unquote(path_info[len('/api/dic/'):])
-        start_response('200 OK', [('Content-Type', 'application/json; charset=utf-8')])
-        return get_definition_json(api_word, builder, '/api/dic')
-    if path_info == '/api/dic':
-        start_response('400 Bad Request', [('Content-Type', 'application/json; charset=utf-8')])
-        return [b'{"error":"word required"}']
+    if path_info == '/metrics':
+        environ['mdx.route'] = 'metrics'
+        start_response('200 OK', [('Content-Type', METRICS_CONTENT_TYPE)])
+        return [REGISTRY.render()]
+    if path_info == '/ready':
+        environ['mdx.route'] = 'ready'
+        return _ready_response(environ, start_response)
+    if path_info == '/api/batch':
+        environ['mdx.route'] = 'batch'
+        return _batch_response(environ, start_response)
+    if path_info == '/api/admin/reload':
+        environ['mdx.route'] = 'admin'
+        return _reload_response(environ, start_response)
+    if path_info == '/api/admin/cache' or path_info.startswith('/api/admin/cache/'):
+        environ['mdx.route'] = 'admin'
+        return _cache_admin_response(environ, start_response, path_info[len('/api/admin/cache'):])
+    if path_info == '/api/suggest':
+        environ['mdx.route'] = 'suggest'
+        return _suggest_response(environ, start_response)
+    if path_info == '/api/export':
+        environ['mdx.route'] = 'export'
+        if builder is None:
+            return _json_error(start_response, '503 Service Unavailable', 'no dictionary loaded')
+        if not _admit(environ):
+            return _overloaded(start_response)
+        start_response('200 OK', [('Content-Type', 'application/x-ndjson; charset=utf-8')])
+        return iter_export_ndjson(builder)
 
-    if path_info.startswith('/api/entry/'):
-        api_word = unquote(path_info[len('/api/entry/'):])
-        start_response('200 OK', [('Content-Type', 'application/json; charset=utf-8')])
-        return get_definition_json(api_word, builder)
-    if path_info == '/api/entry':
+    if path_info.startswith('/api/all/entry/'):
+        environ['mdx.route'] = 'api_all'
+        environ['mdx.word'] = unquote(path_info[len('/api/all/entry/'):])
+        return _all_entry_response(environ, start_response, environ['mdx.word'])
+    route = _api_route(path_info)
+    if route is not None:
+        environ['mdx.route'] = 'api_entry'
+        prefix, media_prefix, api_word, dict_builder = route
+        environ['mdx.word'] = api_word
+        encoding = accepted_encoding(environ)
+        # validators depend only on the dictionary and the word: answer 304 before any lookup
+        etag, last_modified = _json_validators(prefix, api_word, encoding, dict_builder)
+        validators = validator_headers(etag, last_modified)
+        if is_not_modified(environ, etag, last_modified):
+            start_response('304 Not Modified', validators + encoding_headers(None))
+            return []
+        cached = get_cached_definition_json(api_word, dict_builder, media_prefix, encoding)
+        if cached is None and not _admit(environ):
+            return _overloaded(start_response)
+        chunks, applied = cached or get_definition_json_encoded(api_word, dict_builder, media_prefix, encoding)
+        start_response('200 OK', [('Content-Type', 'application/json; charset=utf-8')]
+                       + validators + encoding_headers(applied))
+        return chunks
+    if path_info == '/api/dic' or path_info == '/api/entry':
         start_response('400 Bad Request', [('Content-Type', 'application/json; charset=utf-8')])
         return [b'{"error":"word required"}']
 
-    url_map = get_url_map()
+    if path_info.startswith('/d/'):
+        name, _, rest = path_info[len('/d/'):].partition('/')
+        dict_builder = dictionaries.get(name)
+        if dict_builder is None:
+            start_response('404 Not Found', [('Content-Type', 'text/html; charset=utf-8')])
+            return [b'<p>No such dictionary.</p>']
+        return _dictionary_response(environ, start_response, '/' + rest, dict_builder, dictionary_prefix(name))
+    return _dictionary_response(environ, start_response, path_info, builder)
+
 
-    if path_info in url_map:
-        url_file = url_map[path_info]
+def _dictionary_response(environ, start_response, path_info, dict_builder, url_prefix=''):
+    """Static files, MDD media and HTML entries of one dictionary; path_info is relative to url_prefix."""
+    resource = static_resources.lookup(path_info)
+
+    if resource is not None:
+        environ['mdx.route'] = 'static'
+        # validators describe the bytes served: for a preloaded file, those read at the last refresh
+        url_file, data, size, mtime_ns = resource
+        if size is None:
+            start_response('404 Not Found', [('Content-Type', 'text/html; charset=utf-8')])
+            return [b'<p>File not found.</p>']
         content_type = content_type_map.get(file_util_get_ext(url_file), 'text/html; charset=utf-8')
-        start_response('200 OK', [('Content-Type', content_type)])
-        return [file_util_read_byte(url_file)]
+        mtime = mtime_ns / 1e9
+        etag = make_etag(url_file, size, mtime_ns)
+        validators = validator_headers(etag, mtime)
+        if is_not_modified(environ, etag, mtime):
+            start_response('304 Not Modified', validators)
+            return []
+        if data is not None:
+            return _send_ranged(environ, start_response, [('Content-Type', content_type)] + validators,
+                                size, lambda start, stop: iter_bytes(data, start, stop),
+                                etag, mtime)
+        return _send_ranged(environ, start_response, [('Content-Type', content_type)] + validators,
+                            size, lambda start, stop: file_util_iter_byte(url_file, start, stop),
+                            etag, mtime)
     elif file_util_get_ext(path_info) in content_type_map:
+        environ['mdx.route'] = 'media'
         content_type = content_type_map.get(file_util_get_ext(path_info), 'text/html; charset=utf-8')
-        start_response('200 OK', [('Content-Type', content_type)])
-        return get_definition_mdd(path_info, builder)
+        fingerprint, last_modified = dictionary_fingerprint(dict_builder)
+        etag = make_etag(fingerprint, 'mdd', path_info)
+        validators = validator_headers(etag, last_modified, MEDIA_CACHE_CONTROL)
+        if is_not_modified(environ, etag, last_modified):
+            start_response('304 Not Modified', validators)
+            return []
+        if not _admit(environ):
+            return _overloaded(start_response)
+        content = get_definition_mdd(path_info, dict_builder, view=True)
+        if not content:
+            # do not let clients keep a missing resource for the whole max-age
+            start_response('200 OK', [('Content-Type', content_type)])
+            return []
+        data = content[0]
+        return _send_ranged(environ, start_response, [('Content-Type', content_type)] + validators,
+                            len(data), lambda start, stop: iter_bytes(data, start, stop),
+                            etag, last_modified)
     else:
-        start_response('200 OK', [('Content-Type', 'text/html; charset=utf-8')])
-        return get_definition_mdx(path_info[1:], builder)
+        environ['mdx.route'] = 'html'
+        environ['mdx.word'] = path_info[1:]
+        encoding = accepted_encoding(environ)
+        fingerprint, last_modified = dictionary_fingerprint(dict_builder)
+        etag = make_etag(fingerprint, 'html', path_info[1:], injection_digest(), encoding, url_prefix)
+        # the page embeds the injection files, so it is as new as the newest of them too
+        last_modified = max([t for t in (last_modified, injection_mtime()) if t is not None] or [None])
+        validators = validator_headers(etag, last_modified)
+        if is_not_modified(environ, etag, last_modified):
+            start_response('304 Not Modified', validators + encoding_headers(None))
+            return []
+        cached = get_cached_definition_mdx(path_info[1:], dict_builder, encoding, url_prefix)
+        if cached is None and not _admit(environ):
+            return _overloaded(start_response)
+        chunks, applied = cached or get_definition_mdx_encoded(path_info[1:], dict_builder, encoding, url_prefix)
+        start_response('200 OK', [('Content-Type', 'text/html; charset=utf-8')]
+                       + validators + encoding_headers(applied))
+        return chunks
 
 
     start_response('200 OK', [('Content-Type', 'text/html; charset=utf-8')])
     return [b'<h1>WSGIServer ok!</h1>']
 
 
+def find_mdx_files(paths):
+    """Expand the given files and directories into a list of .mdx files (directories searched recursively)."""
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                result.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith('.mdx'))
+        elif os.path.isfile(path):
+            result.append(path)
+    return result
+
+
+def dictionary_name(path, taken):
+    """URL-safe dictionary name from the file name, unique among ``taken``."""
+    base = re.sub(r'[^\w.-]+', '-', os.path.splitext(os.path.basename(path))[0]).strip('-') or 'dict'
+    name, n = base, 1
+    while name in taken or name in RESERVED_NAMES:
+        n += 1
+        name = '{}-{}'.format(base, n)
+    return name
+
+
+def load_dictionaries(paths, read_only=False, use_mmap=False):
+    """Build an IndexBuilder per MDX file into ``dictionaries``; the first becomes ``builder``."""
+    global builder
+    load_options.update(read_only=read_only, use_mmap=use_mmap)
+    for path in find_mdx_files(paths):
+        name = dictionary_name(path, dictionaries)
+        dictionaries[name] = IndexBuilder(path, read_only=read_only, use_mmap=use_mmap)
+        print("dictionary [ {} ] : {}".format(name, path))
+    if dictionaries:
+        builder = next(iter(dictionaries.values()))
+    return dictionaries
+
+
+def map_dictionary_files():
+    for d in dictionaries.values():
+        d.map_files()
+
+
+def dictionary_changed(d):
+    try:
+        return d.stat_identity() != d.get_identity()
+    except OSError:
+        return False  # being replaced right now; the next check will see the new file
+
+
+def dictionary_file_stats():
+    """Snapshot of every loaded dictionary's files, for the file watcher."""
+    stats = []
+    for d in dictionaries.values():
+        try:
+            stats.append(d.stat_identity())
+        except OSError:
+            stats.append(None)
+    return stats
+
+
+def reload_dictionaries(rebuild_index=True):
+    """Replace every dictionary whose files changed with a freshly built IndexBuilder.
+
+    The new builder (indexes, spelling index, suggest array) is prepared while
+    the old one keeps serving; then it is swapped in, requests that started
+    before the swap are drained, and only the old dictionary's cache entries
+    are purged.  With rebuild_index=False the index files are assumed to be
+    current already (prefork workers, after the supervisor rebuilt them).
+    """
+    global builder, suggest_index
+    with reload_lock:
+        for name, old in list(dictionaries.items()):
+            if not dictionary_changed(old):
+                continue
+            print("reloading dictionary [ {} ]".format(name))
+            try:
+                new = IndexBuilder(old.get_mdx_file(), force_rebuild=rebuild_index, **load_options)
+                if load_options.get('use_mmap'):
+                    new.map_files()
+                get_spell_index(new)
+                new_suggest = PrefixIndex.from_builder(new) if old is builder else None
+            except Exception:
+                traceback.print_exc()
+                print("reload of [ {} ] failed, still serving the previous version".format(name))
+                continue
+            dictionaries[name] = new
+            if old is builder:
+                with suggest_lock:
+                    suggest_index = (new, new_suggest)
+                    builder = new
+            drained = request_tracker.drain(request_tracker.advance())
+            purged = purge_dictionary_cache(old)
+            print("dictionary [ {} ] reloaded, {} cache entries purged{}".format(
+                name, purged, '' if drained else ' (timed out waiting for in-flight requests)'))
+
+
+def trigger_reload():
+    """Start a reload in the background; prefork workers ask the supervisor instead."""
+    if reload_via_supervisor:
+        os.kill(os.getppid(), signal.SIGHUP)
+    else:
+        threading.Thread(target=reload_dictionaries, daemon=True).start()
+
+
+def _prefork_worker_started():
+    global reload_lock, reload_via_supervisor
+    # a reload may have held the lock in the supervisor when this worker was forked
+    reload_lock = threading.Lock()
+    reload_via_supervisor = True
+
+
 # 新线程执行的代码
-def loop():
+def loop(host='', port=8888, mode='thread', workers=None, queue_size=64, threads=4):
+    if mode == 'prefork':
+        serve_prefork(application, host, port, workers=workers, threads=threads,
+                      queue_size=queue_size, handler_class=QuietWSGIRequestHandler,
+                      before_fork=map_dictionary_files,
+                      after_fork=_prefork_worker_started, reload=reload_dictionaries,
+                      worker_reload=lambda: reload_dictionaries(rebuild_index=False))
+        return
+    if mode == 'async':
+        print("Serving HTTP on port {} (async mode, {} workers)...".format(port, workers))
+        run_async_server(application, host, port, workers=workers, cached_response=cached_api_response)
+        return
     # 创建一个服务器，IP地址为空，端口是8888，处理函数是application:
-    httpd = make_server('', 8888, application)
-    print("Serving HTTP on port 8888...")
+    httpd = make_pooled_server(host, port, application, mode=mode, workers=workers, queue_size=queue_size,
+                               handler_class=QuietWSGIRequestHandler)
+    if mode == 'simple':
+        print("Serving HTTP on port {}...".format(port))
+    else:
+        print("Serving HTTP on port {} ({} mode, {} workers)...".format(port, mode, workers))
     # 开始监听HTTP请求:
     httpd.serve_forever()
 
@@ -131,16 +854,135 @@ def select_file_with_gui():
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument("filename", nargs='?', help="mdx file name")
+    parser.add_argument("filename", nargs='*',
+                        help="mdx files or directories of mdx files; the first is also served at /")
+    parser.add_argument("--host", default='', help="address to bind, default all interfaces")
+    parser.add_argument("--port", type=int, default=8888, help="port to listen on")
+    parser.add_argument("--mode", choices=SERVER_MODES + ('process', 'async', 'prefork'), default='thread',
+                        help="simple: one request at a time; thread: worker thread pool; "
+                             "process: --workers supervised single-threaded processes (prefork with --threads 1); "
+                             "async: aiohttp event loop with lookups on a --workers thread pool; "
+                             "prefork: --workers supervised processes x --threads threads")
+    parser.add_argument("--workers", type=int, default=default_workers(),
+                        help="size of the worker pool")
+    parser.add_argument("--threads", type=int, default=4,
+                        help="worker threads in each process (prefork mode)")
+    parser.add_argument("--queue-size", type=int, default=64,
+                        help="accepted connections waiting for a worker (thread and prefork mode)")
+    parser.add_argument("--cache-mb", type=int, default=1024,
+                        help="memory budget of the entry cache shared by all dictionaries, in MB")
+    parser.add_argument("--max-concurrent", type=int, default=0,
+                        help="dictionary lookups running at once per process, 0 for half the worker "
+                             "threads; cache hits and static files are not limited")
+    parser.add_argument("--max-queue", type=int, default=-1,
+                        help="lookups waiting for a slot before further ones get 503 + Retry-After, "
+                             "-1 to keep about a quarter of the worker threads free for cache hits")
+    parser.add_argument("--negative-cache-size", type=int, default=100000,
+                        help="words and media files remembered as missing, 0 to disable")
+    parser.add_argument("--negative-cache-ttl", type=float, default=600.0,
+                        help="seconds a word or media file is remembered as missing")
+    parser.add_argument("--disk-cache-mb", type=int, default=0,
+                        help="size of the on-disk second-tier cache of JSON entries, one <mdx>.cache.db "
+                             "per dictionary shared by all worker processes, in MB; 0 disables it")
+    parser.add_argument("--disk-cache-read-only", action='store_true',
+                        help="only read existing .cache.db files (e.g. prebuilt and shared by replicas)")
+    parser.add_argument("--admin-token", default=os.environ.get('MDX_ADMIN_TOKEN'),
+                        help="enable the /api/admin/* endpoints for localhost requests carrying this value in "
+                             "an X-Admin-Token header (default: $MDX_ADMIN_TOKEN); disabled when unset")
+    parser.add_argument("--log-level", choices=sorted(LEVELS, key=LEVELS.get), default='info',
+                        help="debug: access log and lookup details; info: access log; "
+                             "warning/error/off: no per-request output")
+    parser.add_argument("--access-log", default='-',
+                        help="file the JSON-lines log is appended to, '-' for stdout")
+    parser.add_argument("--access-log-sample", type=float, default=1.0,
+                        help="fraction of requests written to the access log (5xx are always written)")
+    parser.add_argument("--reload-interval", type=float, default=5.0,
+                        help="seconds between checks for changed dictionary files, 0 to disable "
+                             "(SIGHUP and POST /api/admin/reload still work)")
+    parser.add_argument("--warmup", action='append', default=[], metavar='FILE',
+                        help="warm the entry cache at startup from a frequency-ranked word list "
+                             "(one word per line, optionally followed by a count) or a JSON-lines "
+                             "access log; may be given more than once")
+    parser.add_argument("--warmup-top", type=int, default=20000,
+                        help="number of most frequent words to warm")
+    parser.add_argument("--warmup-workers", type=int, default=4,
+                        help="threads warming the cache")
+    parser.add_argument("--warmup-seconds", type=float, default=300.0,
+                        help="time budget of the warm-up")
+    parser.add_argument("--warmup-mb", type=int, default=0,
+                        help="stop warming once the entry cache holds this many MB, 0 for half of --cache-mb")
+    parser.add_argument("--ready-threshold", type=float, default=0.9,
+                        help="fraction of the warm-up words cached before /ready answers 200 "
+                             "(it also does once the warm-up stops on a budget)")
     args = parser.parse_args()
+    if args.workers <= 0 or args.queue_size <= 0 or args.threads <= 0 or args.cache_mb <= 0:
+        parser.error("workers, threads, queue-size and cache-mb must be positive integers")
+    if not 0.0 <= args.access_log_sample <= 1.0:
+        parser.error("access-log-sample must be between 0 and 1")
+    if not 0.0 <= args.ready_threshold <= 1.0:
+        parser.error("ready-threshold must be between 0 and 1")
+    if args.disk_cache_mb < 0 or args.negative_cache_size < 0 or args.negative_cache_ttl < 0:
+        parser.error("disk-cache-mb, negative-cache-size and negative-cache-ttl must not be negative")
+    if args.warmup_top <= 0 or args.warmup_workers <= 0 or args.warmup_mb < 0:
+        parser.error("warmup-top and warmup-workers must be positive, warmup-mb not negative")
+    json_cache.max_bytes = args.cache_mb * 1024 * 1024
+    admin_token = args.admin_token or None
+    enable_disk_cache(args.disk_cache_mb * 1024 * 1024, args.disk_cache_read_only)
+    negative_cache.max_entries = args.negative_cache_size
+    negative_cache.ttl = args.negative_cache_ttl
+    configure_logging(args.log_level, args.access_log, args.access_log_sample)
+    if args.mode in ('thread', 'async', 'prefork'):
+        pool_size = args.threads if args.mode == 'prefork' else args.workers
+        limit, queue_depth = default_limits(pool_size)
+        admission = AdmissionController(args.max_concurrent or limit,
+                                        queue_depth if args.max_queue < 0 else args.max_queue)
+        register_admission_metrics()
+    if args.mode == 'process':
+        # long-lived workers keep their caches and handles, unlike a child forked per request;
+        # rewritten after the admission setup: a single-threaded worker has nothing to shed for
+        args.mode, args.threads = 'prefork', 1
 
     # use GUI to select file, default to extract
     if not args.filename:
-        args.filename = select_file_with_gui()
+        args.filename = [select_file_with_gui()]
 
-    if not os.path.exists(args.filename):
+    if not find_mdx_files(args.filename):
         print("Please specify a valid MDX/MDD file")
     else:
-        builder = IndexBuilder(args.filename)
-        t = threading.Thread(target=loop, args=())
-        t.start()
+        prefork = args.mode == 'prefork'
+        load_dictionaries(args.filename, read_only=prefork, use_mmap=prefork)
+        get_suggest_index()
+        for d in dictionaries.values():
+            get_spell_index(d)
+            # create the cache files before any worker process opens them
+            get_disk_cache(d)
+        if prefork:
+            # the supervisor rebuilds indexes once, then tells its workers to reopen them
+            on_change = lambda: os.kill(os.getpid(), signal.SIGHUP)
+        else:
+            on_change = reload_dictionaries
+            if hasattr(signal, 'SIGHUP'):
+                signal.signal(signal.SIGHUP, lambda signum, frame: trigger_reload())
+        if args.reload_interval > 0:
+            FileWatcher(dictionary_file_stats, on_change, args.reload_interval).start()
+        if args.warmup:
+            # prefork workers inherit the supervisor's cache, so warm it before forking
+            start_warmup(args.warmup, args.warmup_top, args.warmup_workers, args.warmup_seconds,
+                         args.warmup_mb or args.cache_mb // 2, args.ready_threshold, background=not prefork)
+        serve_args = {
+            'host': args.host,
+            'port': args.port,
+            'mode': args.mode,
+            'workers': args.workers,
+            'queue_size': args.queue_size,
+            'threads': args.threads,
+        }
+        if args.mode in ('async', 'prefork'):
+            # asyncio needs the main thread to stay alive for its executor,
+            # and the prefork supervisor installs signal handlers
+            loop(**serve_args)
+        else:
+            t = threading.Thread(target=loop, kwargs=serve_args)
+            t.start()
+            # keep the main thread alive: concurrent.futures refuses new work once it exits
+            t.join()
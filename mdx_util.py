@@ -1,34 +1,73 @@
 # -*- coding: utf-8 -*-
-# version: python 3.5
+# version: python 3.7
 
-import sys
 import re
 import threading
 import os
+import hashlib
+import sqlite3
+import html
+import time
+import weakref
+from urllib.parse import quote
 from collections import OrderedDict
 from file_util import *
 from json_parser import parse_entry, to_json_bytes
+from resource_util import ResourceDirectory, find_resource_path
+from http_util import MIN_COMPRESS_BYTES, STREAM_CHUNK_SIZE, compress_body
+from suggest_util import SpellIndex
+from metrics_util import REGISTRY, CallbackMetric, note_cache, observe_stage
+from log_util import log
+from singleflight_util import SingleFlight
+from disk_cache_util import DiskCache
+from cache_util import NegativeCache, TinyLFUCacheBytes
+from lemma import get_lemmatizer
 
 
-def _normalize_html(html):
-    html = html.replace("\r\n", "").replace("entry:/", "")
-    html = re.sub(r'(?i)sound://', '/sound/', html)
+def _normalize_html(html, url_prefix=''):
+    """Turn entry:// and sound:// links into server URLs, under url_prefix (e.g. /d/oald)."""
+    html = html.replace("\r\n", "").replace("entry:/", url_prefix)
+    html = re.sub(r'(?i)sound://', url_prefix + '/sound/', html)
     return html
 
 
-def _lookup_entry_html(word, builder):
-    if builder is None:
+def _miss_key(builder, word, kind='mdx'):
+    # headword lookups are case sensitive, MDD lookups are not: "Apple" missing says nothing about "apple"
+    return dictionary_fingerprint(builder)[0], kind, word.lower() if kind == 'mdd' else word
+
+
+def _lookup_entry_html(word, builder, url_prefix=''):
+    if builder is None or negative_cache.get(_miss_key(builder, word)) is not None:
         return "", word
+    return _resolve_entry_html(word, builder.mdx_lookup(word), builder, url_prefix)
+
+
+def _base_forms(word, builder):
+    """Headwords to try for a missing word: those listing it as an inflected form, then lemma candidates."""
+    started = time.perf_counter()
+    candidates = builder.lookup_inflections(word) + list(get_lemmatizer().candidates(word))
+    observe_stage('lemma', time.perf_counter() - started)
+    return list(dict.fromkeys(candidates))
+
+
+def _resolve_entry_html(word, content, builder, url_prefix='', prefetched=None, base_forms=None):
+    """Apply the inflection/lemma fallback and @@@LINK redirects to the records found for word.
+
+    prefetched maps words already looked up (e.g. lemma candidates of a batch) to their records;
+    base_forms are the fallback candidates, if already known.
+    """
     search_word = word
-    content = builder.mdx_lookup(search_word)
     if len(content) < 1:
-        fp = os.popen('python lemma.py ' + word)
-        lemma_word = fp.read().strip()
-        fp.close()
-        if lemma_word:
-            print("lemma: " + lemma_word)
-            search_word = lemma_word
-            content = builder.mdx_lookup(search_word)
+        candidates = _base_forms(word, builder) if base_forms is None else base_forms
+        for candidate in candidates:
+            if prefetched is not None and candidate in prefetched:
+                content = prefetched[candidate]
+            else:
+                content = builder.mdx_lookup(candidate)
+            if content:
+                log.debug("lemma", word=word, lemma=candidate)
+                search_word = candidate
+                break
     pattern = re.compile(r"@@@LINK=([\\w\\s]*)")
     if content:
         rst = pattern.match(content[0])
@@ -39,7 +78,10 @@ def _lookup_entry_html(word, builder):
     str_content = ""
     if len(content) > 0:
         for c in content:
-            str_content += _normalize_html(c)
+            str_content += _normalize_html(c, url_prefix)
+    else:
+        # the suggestions every miss response shows are kept with the negative entry
+        negative_cache.set(_miss_key(builder, word), get_spell_index(builder).suggest(word) if word else [])
     return str_content, search_word
 
 
@@ -49,11 +91,16 @@ class LRUCacheBytes(object):
         self.current_bytes = 0
         self.data = OrderedDict()
         self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     def get(self, key):
         with self.lock:
             if key not in self.data:
+                self.misses += 1
                 return None
+            self.hits += 1
             value = self.data.pop(key)
             self.data[key] = value
             return value
@@ -71,37 +118,148 @@ class LRUCacheBytes(object):
             while self.current_bytes > self.max_bytes and self.data:
                 _, evicted = self.data.popitem(last=False)
                 self.current_bytes -= len(evicted)
+                self.evictions += 1
 
+    def __len__(self):
+        return len(self.data)
 
-CACHE_VERSION = 'json-v3'
-json_cache = LRUCacheBytes(max_bytes=1024 * 1024 * 1024)  # 1GB
+    def resize(self, max_bytes):
+        """Change the budget, evicting least recently used entries at once if it shrank."""
+        with self.lock:
+            self.max_bytes = max_bytes
+            while self.current_bytes > self.max_bytes and self.data:
+                _, evicted = self.data.popitem(last=False)
+                self.current_bytes -= len(evicted)
+                self.evictions += 1
+
+    def hottest_keys(self, limit):
+        """Up to limit keys, most recently used first."""
+        with self.lock:
+            keys = []
+            for key in reversed(self.data):
+                if len(keys) >= limit:
+                    break
+                keys.append(key)
+        return keys
+
+    def discard_matching(self, predicate):
+        """Remove every entry whose key satisfies predicate; returns the number removed."""
+        with self.lock:
+            keys = [key for key in self.data if predicate(key)]
+            for key in keys:
+                self.current_bytes -= len(self.data.pop(key))
+        return len(keys)
+
+
+# bump whenever the JSON/HTML output or how a word resolves changes: ETags and disk-cache keys derive from it
+CACHE_VERSION = 'json-v6'
+# sharded W-TinyLFU: hits on different shards do not contend, and rare words do not flush hot ones
+json_cache = TinyLFUCacheBytes(max_bytes=1024 * 1024 * 1024)  # 1GB
+
+# caches shown on /metrics: name -> TinyLFUCacheBytes, LRUCacheBytes, DiskCache or NegativeCache
+metric_caches = OrderedDict()
+
+
+def _cache_samples(attr):
+    # None reads the entry count; caches without the attribute (no byte budget) are left out
+    samples = []
+    for name, cache in list(metric_caches.items()):
+        value = len(cache) if attr is None else getattr(cache, attr, None)
+        if value is not None:
+            samples.append(((name,), value))
+    return samples
+
+
+def register_cache_metrics(name, cache):
+    """Expose a cache on /metrics under cache="name"."""
+    if not metric_caches:
+        for metric, kind, documentation, attr in (
+                ('mdx_cache_hits_total', 'counter', 'Cache lookups that found an entry.', 'hits'),
+                ('mdx_cache_misses_total', 'counter', 'Cache lookups that found nothing.', 'misses'),
+                ('mdx_cache_evictions_total', 'counter', 'Entries evicted to stay within the budget.', 'evictions'),
+                ('mdx_cache_bytes', 'gauge', 'Bytes held by the cache.', 'current_bytes'),
+                ('mdx_cache_max_bytes', 'gauge', 'Size budget of the cache.', 'max_bytes'),
+                ('mdx_cache_entries', 'gauge', 'Entries held by the cache.', None)):
+            REGISTRY.register(CallbackMetric(metric, documentation, kind, ('cache',),
+                                             lambda attr=attr: _cache_samples(attr)))
+    metric_caches[name] = cache
+
+
+register_cache_metrics('json', json_cache)
+# words and media files known to be missing, keyed by (dictionary fingerprint, kind, word);
+# a repeated miss skips SQLite, the lemmatizer and the MDD candidate keys
+negative_cache = NegativeCache(max_entries=100000, ttl=600.0)
+register_cache_metrics('negative', negative_cache)
+_cache_stats_since = time.time()
 
-def get_definition_mdx(word, builder):
-    """根据关键字得到MDX词典的解释"""
-    str_content, _ = _lookup_entry_html(word, builder)
-    if not str_content:
-        str_content = "<p>No entry found.</p>"
-    injection = []
-    injection_html = ''
-    output_html = ''
 
-    try:
-        # PyInstaller creates a temp folder and stores path in _MEIPASS
-        # base_path = sys._MEIPASS
-        base_path = os.path.dirname(sys.executable)
-    except Exception:
-        base_path = os.path.abspath(".")
-            
-    resource_path = os.path.join(base_path, 'mdx')
+def cache_stats():
+    """Size, hit ratio and eviction rate (per second since startup) of every cache."""
+    elapsed = max(time.time() - _cache_stats_since, 1e-9)
+    stats = []
+    for name, cache in list(metric_caches.items()):
+        lookups = cache.hits + cache.misses
+        stats.append({'name': name, 'entries': len(cache), 'bytes': getattr(cache, 'current_bytes', None),
+                      'max_bytes': getattr(cache, 'max_bytes', None), 'hits': cache.hits, 'misses': cache.misses,
+                      'hit_ratio': round(cache.hits / lookups, 4) if lookups else None,
+                      'evictions': cache.evictions,
+                      'evictions_per_second': round(cache.evictions / elapsed, 4)})
+    return stats
 
-    file_util_get_files(resource_path, injection)
+# optional second tier for JSON entries: an SQLite file beside each .mdx, shared by worker processes
+DISK_CACHE_SUFFIX = '.cache.db'
+disk_cache_options = {'max_bytes': 0, 'read_only': False}
+_disk_caches = {}  # path -> DiskCache
+_disk_cache_versions = {}  # path -> (last_modified, key prefix) of the newest dictionary seen
+_disk_cache_lock = threading.Lock()
 
-    for p in injection:
-        if file_util_is_ext(p, 'html'):
-            injection_html += file_util_read_text(p)
 
-    output_html = str_content + injection_html
-    return [output_html.encode('utf-8')]
+def enable_disk_cache(max_bytes, read_only=False):
+    disk_cache_options.update(max_bytes=max_bytes, read_only=read_only)
+
+
+def get_disk_cache(builder):
+    """The builder's DiskCache, or None when the disk cache is disabled."""
+    if builder is None or not disk_cache_options['max_bytes']:
+        return None
+    path = builder.get_mdx_file() + DISK_CACHE_SUFFIX
+    fingerprint, last_modified = dictionary_fingerprint(builder)
+    version = (last_modified, '{}:{}:'.format(CACHE_VERSION, fingerprint))
+    cache = _disk_caches.get(path)
+    if cache is None or _disk_cache_versions[path] != version:
+        with _disk_cache_lock:
+            cache = _disk_caches.get(path)
+            if cache is None:
+                try:
+                    cache = DiskCache(path, disk_cache_options['max_bytes'], disk_cache_options['read_only'])
+                except sqlite3.Error as e:
+                    log.warning("disk cache disabled", path=path, error=str(e))
+                    disk_cache_options['max_bytes'] = 0
+                    return None
+                _disk_caches[path] = cache
+                _disk_cache_versions[path] = (None, None)
+                register_cache_metrics('disk:' + os.path.basename(builder.get_mdx_file()), cache)
+            current = _disk_cache_versions[path]
+            if current[0] is None or version[0] > current[0]:
+                # a newer dictionary file (or CACHE_VERSION) makes the other entries dead;
+                # requests still draining on the old dictionary must not prune the new ones
+                cache.retain_prefix(version[1])
+                _disk_cache_versions[path] = version
+    return cache
+# mdx/*.html appended to every HTML entry, kept encoded in memory
+injection_resources = ResourceDirectory(find_resource_path(), ('html',))
+
+def get_definition_mdx(word, builder, url_prefix=''):
+    """根据关键字得到MDX词典的解释（url_prefix 为多词典路由前缀，如 /d/oald）"""
+    str_content, _ = _lookup_entry_html(word, builder, url_prefix)
+    if not str_content:
+        str_content = "<p>No entry found.</p>"
+        suggestions = suggest_corrections(word, builder)
+        if suggestions:
+            links = ['<a href="{}/{}">{}</a>'.format(url_prefix, quote(s), html.escape(s)) for s in suggestions]
+            str_content += "<p>Did you mean: {}</p>".format(", ".join(links))
+    # entry and injection are sent as separate chunks, no concatenated copy
+    return [str_content.encode('utf-8'), injection_resources.joined_bytes('html')]
 
 
 def _rewrite_media_urls(data, base):
@@ -150,33 +308,399 @@ def _rewrite_media_urls(data, base):
                         im['image'] = ri(ig)
     return data
 
+_fingerprints = weakref.WeakKeyDictionary()
+
+
+def dictionary_fingerprint(builder):
+    """Return (fingerprint, last_modified) of the builder's files and CACHE_VERSION."""
+    if builder is None:
+        return CACHE_VERSION, None
+    result = _fingerprints.get(builder)
+    if result is None:
+        identity = builder.get_identity()
+        text = '\0'.join('{}:{}:{}'.format(*item) for item in identity) + '\0' + CACHE_VERSION
+        result = (hashlib.sha1(text.encode('utf-8')).hexdigest()[:16], max(item[2] for item in identity))
+        _fingerprints[builder] = result
+    return result
+
+
+def purge_dictionary_cache(builder):
+    """Drop the json_cache entries (JSON, HTML and their compressed variants) of one dictionary."""
+    fingerprint, _ = dictionary_fingerprint(builder)
+    prefixes = ('{}:{}:'.format(CACHE_VERSION, fingerprint), '{}:html:{}:'.format(CACHE_VERSION, fingerprint))
+    negative_cache.discard_matching(lambda key: key[0] == fingerprint)
+    return json_cache.discard_matching(lambda key: key.startswith(prefixes))
+
+
+def parse_cache_key(key):
+    """Split a json_cache key into its parts, or None for a key of another format.
+
+    Returns a dict with kind ('json' or 'html'), version, fingerprint, prefix
+    (media prefix of a JSON entry, URL prefix of an HTML page), word and
+    encoding (None for the uncompressed JSON entry).
+    """
+    base, sep, encoding = key.rpartition('|')
+    if not sep or encoding not in ('gzip', 'br'):
+        base, encoding = key, None
+    parts = base.split(':', 5)
+    if len(parts) == 6 and parts[1] == 'html':
+        version, _, fingerprint, digest, prefix, word = parts
+        return {'kind': 'html', 'version': version, 'fingerprint': fingerprint, 'digest': digest,
+                'prefix': prefix, 'word': word, 'encoding': encoding}
+    parts = base.split(':', 3)
+    if len(parts) == 4:
+        version, fingerprint, media_prefix, word = parts
+        return {'kind': 'json', 'version': version, 'fingerprint': fingerprint,
+                'prefix': None if media_prefix == 'none' else media_prefix, 'word': word, 'encoding': encoding}
+    return None
+
+
+def _word_matcher(word=None, prefix=None, fold_case=False):
+    fold = str.lower if fold_case else str
+    if word is not None:
+        word = fold(word)
+        return lambda w: fold(w) == word
+    if prefix is not None:
+        prefix = fold(prefix)
+        return lambda w: fold(w).startswith(prefix)
+    return None
+
+
+def _cache_key_matcher(word=None, prefix=None, version=None):
+    if version is not None:
+        return lambda key: key.startswith(version + ':')
+    test = _word_matcher(word, prefix)
+    if test is None:
+        return lambda key: True
+
+    def matches(key):
+        parts = parse_cache_key(key)
+        return parts is not None and test(parts['word'])
+    return matches
+
+
+def purge_cache(word=None, prefix=None, version=None):
+    """Drop the entries of a word, of the words starting with prefix, or of a CACHE_VERSION; all if none given.
+
+    Entries are removed from json_cache and the negative cache at once and
+    from the disk caches in the background.  Returns the number removed from
+    json_cache.
+    """
+    matches = _cache_key_matcher(word, prefix, version)
+    for cache in list(_disk_caches.values()):
+        cache.discard_matching(matches)
+    if version is None and (word is not None or prefix is not None):
+        # media misses are keyed case-insensitively, like their lookups (see _miss_key)
+        tests = {'mdx': _word_matcher(word, prefix), 'mdd': _word_matcher(word, prefix, fold_case=True)}
+        negative_cache.discard_matching(lambda key: tests[key[1]](key[2]))
+    else:
+        negative_cache.discard_matching(lambda key: True)
+    return json_cache.discard_matching(matches)
+
+
+def injection_digest():
+    """Digest of the current injection payload, for validators on HTML entries."""
+    return injection_resources.joined_digest('html')
+
+
+def injection_mtime():
+    """Newest mtime of the injection files, so Last-Modified of HTML entries moves with injection_digest()."""
+    return injection_resources.joined_mtime('html')
+
+
+def json_cache_key(word, builder, media_prefix=None):
+    # json_cache is shared by every loaded dictionary: scope keys by dictionary fingerprint
+    fingerprint, _ = dictionary_fingerprint(builder)
+    return "{}:{}:{}:{}".format(CACHE_VERSION, fingerprint, (media_prefix or 'none'), word)
+
+
+def _encoded_variant(cache_key, raw, encoding):
+    """Return (body, applied encoding); compressed variants are cached next to the raw entry."""
+    if encoding is None or len(raw) < MIN_COMPRESS_BYTES:
+        return raw, None
+    variant_key = cache_key + '|' + encoding
+    body = json_cache.get(variant_key)
+    if body is None:
+        body = compress_body(raw, encoding)
+        json_cache.set(variant_key, body)
+    return body, encoding
+
+
+def get_cached_definition_json(word, builder, media_prefix=None, encoding=None, compress=True):
+    """Return ([body], applied encoding) from json_cache, or None; never touches the dictionary.
+
+    With compress=False (the event loop) it is also None when only the raw
+    entry is cached and would have to be compressed.
+    """
+    cache_key = json_cache_key(word, builder, media_prefix)
+    if encoding is not None:
+        body = json_cache.get(cache_key + '|' + encoding)
+        if body is not None:
+            note_cache(True)
+            return [body], encoding
+    cached = json_cache.get(cache_key)
+    if cached is None:
+        return None
+    if not compress and encoding is not None and len(cached) >= MIN_COMPRESS_BYTES:
+        return None
+    note_cache(True)
+    body, applied = _encoded_variant(cache_key, cached, encoding)
+    return [body], applied
+
+
+# concurrent misses on the same cache key (or media file) share one lookup
+json_flight = SingleFlight()
+mdd_flight = SingleFlight()
+REGISTRY.register(CallbackMetric(
+    'mdx_singleflight_calls_total', 'Lookups that computed a result (leader) or waited for one (shared).',
+    'counter', ('kind', 'role'),
+    lambda: [(('json', 'leader'), json_flight.leaders), (('json', 'shared'), json_flight.shared),
+             (('mdd', 'leader'), mdd_flight.leaders), (('mdd', 'shared'), mdd_flight.shared)]))
+
+
+def _compute_definition_json(word, builder, media_prefix, cache_key):
+    # a lookup that finished just before this one started may have filled the cache
+    cached = json_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    disk_cache = get_disk_cache(builder)
+    result = disk_cache.get(cache_key) if disk_cache is not None else None
+    if result is None:
+        html_content, resolved = _lookup_entry_html(word, builder)
+        result = _entry_json_bytes(word, html_content, resolved, media_prefix, builder)
+        if disk_cache is not None:
+            disk_cache.set(cache_key, result)
+    json_cache.set(cache_key, result)
+    return result
+
+
 def get_definition_json(word, builder, media_prefix=None):
-    cache_key = "{}:{}:{}".format(CACHE_VERSION, (media_prefix or 'none'), word.lower())
+    cache_key = json_cache_key(word, builder, media_prefix)
     cached = json_cache.get(cache_key)
+    note_cache(cached is not None)
     if cached is not None:
         return [cached]
-    html_content, resolved = _lookup_entry_html(word, builder)
+    return [json_flight.do(cache_key, _compute_definition_json, word, builder, media_prefix, cache_key)]
+
+
+_spell_indexes = weakref.WeakKeyDictionary()
+_spell_lock = threading.Lock()
+
+
+def get_spell_index(builder):
+    """Return the builder's SpellIndex, building the .spell.db file on first use."""
+    spell = _spell_indexes.get(builder)
+    if spell is None:
+        with _spell_lock:
+            spell = _spell_indexes.get(builder)
+            if spell is None:
+                spell = SpellIndex.for_builder(builder)
+                _spell_indexes[builder] = spell
+    return spell
+
+
+def suggest_corrections(word, builder):
+    """Closest headwords within edit distance 2, for lookups that found nothing."""
+    if builder is None or not word:
+        return []
+    suggestions = negative_cache.get(_miss_key(builder, word))
+    if suggestions is None:
+        suggestions = get_spell_index(builder).suggest(word)
+    return suggestions
+
+
+def _entry_json_bytes(word, html_content, resolved, media_prefix=None, builder=None):
     active_word = resolved or word
     if not html_content:
         data = {'word': active_word, 'found': False}
+        suggestions = suggest_corrections(word, builder)
+        if suggestions:
+            data['suggestions'] = suggestions
     else:
+        started = time.perf_counter()
         try:
             data = parse_entry(html_content, resolved_word=active_word)
             data.setdefault('word', active_word)
         except RuntimeError as exc:
             data = {'word': active_word, 'error': str(exc)}
+        observe_stage('parse_entry', time.perf_counter() - started)
     if media_prefix:
         data = _rewrite_media_urls(data, media_prefix)
+    started = time.perf_counter()
     result = to_json_bytes(data)
-    json_cache.set(cache_key, result)
-    return [result]
+    observe_stage('to_json', time.perf_counter() - started)
+    return result
+
+
+BATCH_MAX_WORDS = 500
 
-def get_definition_mdd(word, builder):
-    """根据关键字得到MDX词典的媒体"""
+
+def get_definitions_batch(words, builder, media_prefix=None):
+    """Return a JSON object mapping each word to its get_definition_json entry.
+
+    Cached entries are copied straight from json_cache; all misses are looked
+    up with a single builder.mdx_lookup_many call, which decompresses each
+    record block once.
+    """
+    words = list(dict.fromkeys(words))
+    results = {}
+    missing = []
+    disk_cache = get_disk_cache(builder)
+    for word in words:
+        cache_key = json_cache_key(word, builder, media_prefix)
+        cached = json_cache.get(cache_key)
+        if cached is None and disk_cache is not None:
+            cached = disk_cache.get(cache_key)
+            if cached is not None:
+                json_cache.set(cache_key, cached)
+        note_cache(cached is not None)
+        if cached is not None:
+            results[word] = cached
+        else:
+            missing.append(word)
+    if missing:
+        lookup = [] if builder is None else [
+            word for word in missing if negative_cache.get(_miss_key(builder, word)) is None]
+        found = builder.mdx_lookup_many(lookup) if lookup else {}
+        unresolved = [word for word in lookup if not found.get(word)]
+        candidates = {}
+        if unresolved:
+            # headwords listing each miss as an inflection, then its lemma candidates, looked up together as well
+            started = time.perf_counter()
+            inflections = builder.lookup_inflections_many(unresolved)
+            lemmas = get_lemmatizer().lemmatize_many(unresolved)
+            for word in unresolved:
+                candidates[word] = list(dict.fromkeys(inflections.get(word, []) + list(lemmas[word])))
+            observe_stage('lemma', time.perf_counter() - started)
+            extra = [c for c in dict.fromkeys(c for cs in candidates.values() for c in cs) if c not in found]
+            if extra:
+                found.update(builder.mdx_lookup_many(extra))
+                for candidate in extra:
+                    found.setdefault(candidate, [])
+        lookup = set(lookup)
+        for word in missing:
+            if word not in lookup:
+                html_content, resolved = "", word
+            else:
+                html_content, resolved = _resolve_entry_html(word, found.get(word, []), builder, prefetched=found,
+                                                             base_forms=candidates.get(word))
+            result = _entry_json_bytes(word, html_content, resolved, media_prefix, builder)
+            cache_key = json_cache_key(word, builder, media_prefix)
+            json_cache.set(cache_key, result)
+            if disk_cache is not None:
+                disk_cache.set(cache_key, result)
+            results[word] = result
+    parts = [to_json_bytes(word) + b':' + results[word] for word in words]
+    return b'{' + b','.join(parts) + b'}'
+
+
+def get_definition_json_encoded(word, builder, media_prefix=None, encoding=None):
+    """get_definition_json compressed with encoding ('gzip', 'br' or None).
+
+    Returns ([body], applied encoding); small bodies are sent uncompressed.
+    """
+    cached = get_cached_definition_json(word, builder, media_prefix, encoding)
+    if cached is not None:
+        return cached
+    raw = get_definition_json(word, builder, media_prefix)[0]
+    body, applied = _encoded_variant(json_cache_key(word, builder, media_prefix), raw, encoding)
+    return [body], applied
+
+
+def get_definitions_all(word, dictionaries, executor, media_prefixes=None):
+    """Look word up in every dictionary concurrently.
+
+    ``dictionaries`` maps name -> IndexBuilder; returns one JSON object
+    mapping each name to its get_definition_json entry, in the same order.
+    """
+    media_prefixes = media_prefixes or {}
+    futures = [(name, executor.submit(get_definition_json, word, b, media_prefixes.get(name)))
+               for name, b in dictionaries.items()]
+    parts = [to_json_bytes(name) + b':' + future.result()[0] for name, future in futures]
+    return b'{' + b','.join(parts) + b'}'
+
+
+def html_cache_key(word, builder, url_prefix=''):
+    fingerprint, _ = dictionary_fingerprint(builder)
+    return "{}:html:{}:{}:{}:{}".format(CACHE_VERSION, fingerprint, injection_digest(), url_prefix, word)
+
+
+def get_cached_definition_mdx(word, builder, encoding, url_prefix=''):
+    """Return ([body], encoding) for a compressed HTML page already in json_cache, or None."""
+    if encoding is None:
+        return None
+    body = json_cache.get(html_cache_key(word, builder, url_prefix) + '|' + encoding)
+    if body is None:
+        return None
+    return [body], encoding
+
+
+def get_definition_mdx_encoded(word, builder, encoding=None, url_prefix=''):
+    """get_definition_mdx compressed with encoding; returns (chunks, applied encoding).
+
+    Only the compressed page is cached, so a hot entry is compressed once and
+    later requests for it skip the lookup entirely.
+    """
+    if encoding is None:
+        return get_definition_mdx(word, builder, url_prefix), None
+    cached = get_cached_definition_mdx(word, builder, encoding, url_prefix)
+    note_cache(cached is not None)
+    if cached is not None:
+        return cached
+    cache_key = html_cache_key(word, builder, url_prefix)
+    return json_flight.do(cache_key + '|' + encoding, _compute_definition_mdx_encoded,
+                          word, builder, encoding, url_prefix, cache_key)
+
+
+def _compute_definition_mdx_encoded(word, builder, encoding, url_prefix, cache_key):
+    cached = get_cached_definition_mdx(word, builder, encoding, url_prefix)
+    if cached is not None:
+        return cached
+    chunks = get_definition_mdx(word, builder, url_prefix)
+    body, applied = _encoded_variant(cache_key, b''.join(chunks), encoding)
+    if applied is None:
+        return chunks, None
+    return [body], applied
+
+
+def iter_export_ndjson(builder, media_prefix=None, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield the whole dictionary as newline-delimited JSON, one entry per line.
+
+    Records are parsed in file order straight from the record blocks and
+    bypass json_cache; memory use does not grow with the dictionary.
+    """
+    pattern = re.compile(r"@@@LINK=(.*)")
+    buf = []
+    size = 0
+    for key, record in builder.iter_mdx_records():
+        rst = pattern.match(record)
+        if rst is not None:
+            line = to_json_bytes({'word': key, 'link': rst.group(1).strip()})
+        else:
+            line = _entry_json_bytes(key, _normalize_html(record), key, media_prefix)
+        buf.append(line)
+        buf.append(b'\n')
+        size += len(line) + 1
+        if size >= chunk_size:
+            yield b''.join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield b''.join(buf)
+
+
+def get_definition_mdd(word, builder, view=False):
+    """根据关键字得到MDX词典的媒体（view=True 时返回 memoryview，不复制数据）"""
     if builder is None:
         return []
-    content = builder.mdd_lookup(word)
+    fingerprint, _ = dictionary_fingerprint(builder)
+    miss_key = _miss_key(builder, word, 'mdd')
+    if negative_cache.get(miss_key) is not None:
+        return []
+    # popular audio: concurrent requests for the same file share one lookup and decompression
+    content = mdd_flight.do((fingerprint, word, view), builder.mdd_lookup, word, view)
     if len(content) > 0:
         return [content[0]]
     else:
+        negative_cache.set(miss_key, ())
         return []
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Process-local metrics in the Prometheus text exposition format.
+
+Counters and histograms are plain dicts updated under a lock, so recording a
+value costs a bisect and a few integer additions.  Values such as cache sizes
+are read through callbacks only when /metrics is scraped.
+
+Stage timings and cache results are also collected per request, in a trace
+kept on the serving thread, for the access log.
+"""
+
+import threading
+from bisect import bisect_left
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# request and stage latencies, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# index builds take from milliseconds to many minutes
+BUILD_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=''):
+    parts = ['{}="{}"'.format(n, _escape(v)) for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [(self.name, _labels(self.labelnames, values), value) for values, value in items]
+
+
+class Histogram(object):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][i] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = sorted((values, (list(counts), total)) for values, (counts, total) in self._values.items())
+        result = []
+        for values, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                result.append((self.name + '_bucket',
+                               _labels(self.labelnames, values, 'le="{}"'.format(_number(bound))), cumulative))
+            result.append((self.name + '_sum', _labels(self.labelnames, values), total))
+            result.append((self.name + '_count', _labels(self.labelnames, values), cumulative))
+        return result
+
+
+class CallbackMetric(object):
+    """A gauge or counter whose samples come from ``collect()`` -> [(label values, value), ...]."""
+
+    def __init__(self, name, documentation, kind, labelnames, collect):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self):
+        return [(self.name, _labels(self.labelnames, values), value) for values, value in self.collect()]
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, labels, _number(value)))
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(Counter(
+    'mdx_requests_total', 'HTTP requests by route and status code.', ('route', 'status')))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'mdx_request_duration_seconds', 'Time to serve a request, body included.', ('route',)))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'mdx_stage_duration_seconds',
+    'Time spent in one stage of a lookup: sqlite, decompress, lemma, parse_entry, to_json.', ('stage',)))
+INDEX_BUILD_SECONDS = REGISTRY.register(Histogram(
+    'mdx_index_build_duration_seconds', 'Time to build an index file (mdx, mdd, spell) or the inflection table.', ('kind',),
+    buckets=BUILD_BUCKETS))
+
+
+_trace = threading.local()
+
+
+def start_trace():
+    """Begin collecting stage timings and the cache result of the request on this thread."""
+    trace = {'stages': {}, 'cache': None}
+    _trace.current = trace
+    return trace
+
+
+def end_trace():
+    trace = getattr(_trace, 'current', None)
+    _trace.current = None
+    return trace
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage)
+    trace = getattr(_trace, 'current', None)
+    if trace is not None:
+        stages = trace['stages']
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+
+def note_cache(hit):
+    """Record a cache lookup for the current request; one miss makes the request a miss."""
+    trace = getattr(_trace, 'current', None)
+    if trace is not None and trace['cache'] != 'miss':
+        trace['cache'] = 'hit' if hit else 'miss'
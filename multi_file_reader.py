@@ -100,6 +100,56 @@ class MultiFileReader:
         self._files[self._current_index].seek(within, os.SEEK_SET)
 
 
+class MappedFileReader:
+    """File-like view over a shared read-only mmap with its own position.
+
+    Many readers (one per thread) can share a single mapping; reads slice the
+    mapping instead of moving a shared file offset.
+    """
+
+    def __init__(self, mapping, name=None):
+        self._map = mapping
+        self._length = len(mapping)
+        self._pos = 0
+        self.name = name
+
+    def close(self):
+        # the mapping belongs to whoever created it
+        self._map = None
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            new_pos = offset
+        elif whence == os.SEEK_CUR:
+            new_pos = self._pos + offset
+        elif whence == os.SEEK_END:
+            new_pos = self._length + offset
+        else:
+            raise ValueError("invalid whence value: {}".format(whence))
+        if new_pos < 0:
+            raise ValueError("seek before start of file")
+        self._pos = min(new_pos, self._length)
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            end = self._length
+        else:
+            end = min(self._pos + size, self._length)
+        data = self._map[self._pos:end]
+        self._pos = end
+        return data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
 def open_binary(source):
     """Return a binary file handle for path string or multipart list."""
     if isinstance(source, MultiFileReader):
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Pre-fork serving: N worker processes behind one port, plus a supervisor.
+
+The dictionary index is built once in the parent.  Each forked worker runs a
+small PooledWSGIServer; with SO_REUSEPORT every worker listens on its own
+socket and the kernel balances connections between them, otherwise all
+workers accept on the listening socket inherited from the parent.  The parent
+only supervises: it restarts workers that die and stops them on SIGINT/SIGTERM.
+On SIGHUP it runs ``reload`` (rebuilding changed indexes once, for everybody)
+and then passes SIGHUP on to the workers, which run ``worker_reload``.
+"""
+
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from wsgiref.simple_server import WSGIRequestHandler
+
+from server_pool import PooledWSGIServer
+
+
+# a worker dying sooner than this after start counts as a crash loop
+RESTART_BACKOFF_SECONDS = 1.0
+
+
+def _bind(host, port, reuse_port, listen=True):
+    # the address family follows the host: '::' or another IPv6 address binds an AF_INET6 socket
+    family, _, _, _, address = socket.getaddrinfo(host or None, port, socket.AF_UNSPEC, socket.SOCK_STREAM,
+                                                  0, socket.AI_PASSIVE)[0]
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(address)
+    if listen:
+        sock.listen(PooledWSGIServer.request_queue_size)
+    return sock
+
+
+def _serve_worker(sock, app, threads, queue_size, handler_class):
+    httpd = PooledWSGIServer(sock.getsockname()[:2], handler_class, workers=threads,
+                             queue_size=queue_size, bind_and_activate=False)
+    httpd.socket.close()
+    httpd.socket = sock
+    host, port = sock.getsockname()[:2]
+    httpd.server_address = (host, port)
+    httpd.server_name = socket.getfqdn(host)
+    httpd.server_port = port
+    httpd.setup_environ()
+    httpd.set_app(app)
+    httpd.serve_forever()
+
+
+def _in_background(target):
+    def handler(signum, frame):
+        threading.Thread(target=target, daemon=True).start()
+    return handler
+
+
+def serve_prefork(app, host='', port=8888, workers=None, threads=4, queue_size=64,
+                  handler_class=WSGIRequestHandler, before_fork=None, after_fork=None,
+                  reload=None, worker_reload=None):
+    """Fork ``workers`` processes serving ``app`` and supervise them until stopped.
+
+    ``after_fork`` runs first thing in every worker.  ``reload`` and
+    ``worker_reload`` are run in a background thread of the parent and of each
+    worker on SIGHUP.
+    """
+    workers = workers or (os.cpu_count() or 1)
+    reuse_port = hasattr(socket, 'SO_REUSEPORT')
+    # with SO_REUSEPORT the parent only holds the port; it must not listen,
+    # or the kernel would hand it connections nobody accepts
+    parent_sock = _bind(host, port, reuse_port, listen=not reuse_port)
+    if before_fork is not None:
+        before_fork()
+
+    children = {}
+    stopping = []
+    can_reload = hasattr(signal, 'SIGHUP')
+
+    def spawn(slot):
+        pid = os.fork()
+        if pid:
+            children[pid] = (slot, time.time())
+            return
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            if can_reload:
+                signal.signal(signal.SIGHUP, _in_background(worker_reload) if worker_reload
+                              else signal.SIG_IGN)
+            if after_fork is not None:
+                after_fork()
+            if reuse_port:
+                parent_sock.close()
+                sock = _bind(host, port, True)
+            else:
+                sock = parent_sock
+            _serve_worker(sock, app, threads, queue_size, handler_class)
+        except KeyboardInterrupt:
+            pass
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def reload_all():
+        if reload is not None:
+            reload()
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    if can_reload:
+        signal.signal(signal.SIGHUP, _in_background(reload_all))
+    for slot in range(workers):
+        spawn(slot)
+    print("Serving HTTP on port {} (prefork mode, {} workers x {} threads{})...".format(
+        port, workers, threads, ', SO_REUSEPORT' if reuse_port else ''))
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        if pid not in children:
+            continue
+        slot, started = children.pop(pid)
+        if stopping:
+            continue
+        print("worker {} (pid {}) exited with status {}, restarting".format(slot, pid, status))
+        if time.time() - started < RESTART_BACKOFF_SECONDS:
+            time.sleep(RESTART_BACKOFF_SECONDS)
+        if not stopping:
+            spawn(slot)
+    parent_sock.close()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Support for replacing dictionaries while the server keeps running.
+
+RequestTracker counts in-flight requests by generation, so a reload can wait
+until every request that might still use a replaced dictionary has finished.
+FileWatcher polls a snapshot function in the background and reports changes
+once they have settled.
+"""
+
+import threading
+import time
+import traceback
+
+
+# how long a reload waits for requests still using the old dictionary
+DRAIN_TIMEOUT_SECONDS = 30.0
+
+
+class RequestTracker(object):
+    """In-flight request counts, grouped by the generation they started in."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._generation = 0
+        self._active = {}  # generation -> requests still running
+
+    def begin(self):
+        with self._cond:
+            generation = self._generation
+            self._active[generation] = self._active.get(generation, 0) + 1
+            return generation
+
+    def end(self, generation):
+        with self._cond:
+            count = self._active[generation] - 1
+            if count:
+                self._active[generation] = count
+            else:
+                del self._active[generation]
+                self._cond.notify_all()
+
+    def advance(self):
+        """Start a new generation; returns the one that just ended."""
+        with self._cond:
+            self._generation += 1
+            return self._generation - 1
+
+    def drain(self, generation, timeout=DRAIN_TIMEOUT_SECONDS):
+        """Wait until no request of ``generation`` or earlier is running; False on timeout."""
+        deadline = time.time() + timeout
+        with self._cond:
+            while any(g <= generation for g in self._active):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+
+class FileWatcher(object):
+    """Call ``on_change()`` from a daemon thread when ``snapshot()`` changes.
+
+    A change is reported only once two consecutive polls agree, so a file
+    still being copied into place is not picked up half written.
+    """
+
+    def __init__(self, snapshot, on_change, interval=5.0):
+        self.snapshot = snapshot
+        self.on_change = on_change
+        self.interval = interval
+        self._last = snapshot()
+        self._pending = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='file-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def poll(self):
+        current = self.snapshot()
+        if current != self._last:
+            self._last = current
+            self._pending = True
+        elif self._pending:
+            self._pending = False
+            self.on_change()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.poll()
+            except Exception:
+                traceback.print_exc()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""In-memory route table for the static files under the mdx/ resource directory."""
+
+import hashlib
+import os
+import sys
+import threading
+import time
+
+from file_util import file_util_get_ext, file_util_read_byte
+
+
+def find_resource_path():
+    """mdx/ next to the executable (frozen builds), else next to this module."""
+    try:
+        base_path = os.path.dirname(sys.executable)
+    except Exception:
+        base_path = os.path.abspath(".")
+    resource_path = os.path.join(base_path, 'mdx')
+    if not os.path.isdir(resource_path):
+        resource_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mdx')
+    return resource_path
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ResourceDirectory(object):
+    """URL path -> file map of a directory tree, built once and kept current.
+
+    Only directories whose mtime changed since the last scan are listed again
+    (a directory's mtime changes when entries are added, removed or renamed),
+    and at most once every ``check_interval`` seconds.  Files no larger than
+    ``preload_max_bytes`` are kept in memory and re-read when their own mtime
+    changes.
+    """
+
+    def __init__(self, root, extensions, preload_max_bytes=256 * 1024, check_interval=1.0):
+        self.root = os.path.abspath(root)
+        self.extensions = set(extensions)
+        self.preload_max_bytes = preload_max_bytes
+        self.check_interval = check_interval
+        self._dirs = {}       # directory -> mtime when it was listed
+        self._dir_urls = {}   # directory -> url paths of its files
+        self._url_map = {}    # url path -> file path
+        self._preloaded = {}  # url path -> (mtime, bytes)
+        self._joined = {}     # extension -> (generation, bytes, digest, newest mtime in seconds)
+        self._generation = 0  # bumped whenever a url or a preloaded file changes
+        self._lock = threading.Lock()
+        self._next_check = 0
+        with self._lock:
+            self._scan(self.root)
+            self._next_check = time.time() + self.check_interval
+
+    def _url(self, path):
+        return '/' + os.path.relpath(path, self.root).replace('\\', '/')
+
+    def _forget(self, directory):
+        self._generation += 1
+        for url in self._dir_urls.pop(directory, ()):
+            self._url_map.pop(url, None)
+            self._preloaded.pop(url, None)
+        self._dirs.pop(directory, None)
+
+    def _scan(self, directory):
+        mtime = _mtime(directory)
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            if directory == self.root:
+                print("path [ " + directory + " ] does not exist")
+            self._forget(directory)
+            return
+        stale = set(self._dir_urls.get(directory, ()))
+        self._dirs[directory] = mtime
+        urls = []
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.isdir(path):
+                if path not in self._dirs:
+                    self._scan(path)
+            elif os.path.isfile(path) and file_util_get_ext(path) in self.extensions:
+                url = self._url(path)
+                if url not in self._url_map:
+                    self._generation += 1
+                self._url_map[url] = path
+                urls.append(url)
+                self._preload(url, path)
+        self._dir_urls[directory] = urls
+        for url in stale.difference(urls):
+            self._generation += 1
+            self._url_map.pop(url, None)
+            self._preloaded.pop(url, None)
+
+    def _preload(self, url, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._preloaded.pop(url, None)
+            return
+        if st.st_size > self.preload_max_bytes:
+            if self._preloaded.pop(url, None) is not None:
+                self._generation += 1
+            return
+        cached = self._preloaded.get(url)
+        if cached is None or cached[0] != st.st_mtime_ns:
+            self._preloaded[url] = (st.st_mtime_ns, file_util_read_byte(path))
+            self._generation += 1
+
+    def refresh(self, force=False):
+        now = time.time()
+        if not force and now < self._next_check:
+            return
+        with self._lock:
+            if not force and now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            for directory, mtime in list(self._dirs.items()):
+                if directory not in self._dirs:
+                    continue  # dropped while rescanning its parent
+                current = _mtime(directory)
+                if current is None:
+                    for sub in [d for d in self._dirs if d == directory or d.startswith(directory + os.sep)]:
+                        self._forget(sub)
+                elif current != mtime:
+                    self._scan(directory)
+            for url in list(self._preloaded):
+                self._preload(url, self._url_map[url])
+
+    def url_map(self):
+        """Return the current url path -> file path map (do not modify it)."""
+        self.refresh()
+        return self._url_map
+
+    def lookup(self, url):
+        """Return (file path, preloaded bytes or None, size, mtime_ns) for url, or None if unknown.
+
+        Size and mtime of a preloaded file are those of the bytes returned;
+        for other files they are None if the file has gone since the last scan.
+        """
+        self.refresh()
+        path = self._url_map.get(url)
+        if path is None:
+            return None
+        cached = self._preloaded.get(url)
+        if cached is not None:
+            return path, cached[1], len(cached[1]), cached[0]
+        try:
+            st = os.stat(path)
+        except OSError:
+            return path, None, None, None
+        return path, None, st.st_size, st.st_mtime_ns
+
+    def joined_bytes(self, ext):
+        """Return the contents of every ``ext`` file, in url order, as one bytes object.
+
+        The result is cached until a file is added, removed or (for preloaded
+        files) modified.
+        """
+        return self._joined_entry(ext)[1]
+
+    def joined_digest(self, ext):
+        """Content digest of joined_bytes(ext), usable in validators across restarts."""
+        return self._joined_entry(ext)[2]
+
+    def joined_mtime(self, ext):
+        """Newest mtime (seconds) of the files in joined_bytes(ext), or None if there are none."""
+        return self._joined_entry(ext)[3]
+
+    def _joined_entry(self, ext):
+        self.refresh()
+        cached = self._joined.get(ext)
+        if cached is not None and cached[0] == self._generation:
+            return cached
+        with self._lock:
+            parts = []
+            mtimes = []
+            for url in sorted(self._url_map):
+                if file_util_get_ext(url) != ext:
+                    continue
+                preloaded = self._preloaded.get(url)
+                if preloaded is not None:
+                    parts.append(preloaded[1])
+                    mtimes.append(preloaded[0])
+                else:
+                    parts.append(file_util_read_byte(self._url_map[url]))
+                    mtimes.append(_mtime(self._url_map[url]) or 0)
+            data = b''.join(parts)
+            entry = (self._generation, data, hashlib.sha1(data).hexdigest()[:16],
+                     max(mtimes) / 1e9 if mtimes else None)
+            self._joined[ext] = entry
+        return entry
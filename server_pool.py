@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Bounded worker pools in front of a WSGI application.
+
+wsgiref's WSGIServer handles one request at a time; the servers here accept on
+the main thread and hand each connection to a fixed number of workers.
+"""
+
+import os
+import queue
+import threading
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+
+SERVER_MODES = ('simple', 'thread')
+
+
+def default_workers():
+    return max(2, (os.cpu_count() or 1) * 2)
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    """WSGIRequestHandler without the per-request line on stderr (the application keeps its own access log)."""
+
+    def log_request(self, code='-', size='-'):
+        pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """WSGIServer serving connections from a fixed pool of worker threads.
+
+    Accepted connections wait in a queue of at most ``queue_size`` entries;
+    once it is full the accept loop blocks and further clients stay in the
+    listen backlog.
+    """
+
+    def __init__(self, server_address, handler_class, workers=None, queue_size=64,
+                 bind_and_activate=True):
+        self.workers = workers or default_workers()
+        self._requests = queue.Queue(maxsize=max(1, queue_size))
+        self._threads = []
+        WSGIServer.__init__(self, server_address, handler_class, bind_and_activate)
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name='mdx-worker-%d' % i)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def process_request(self, request, client_address):
+        self._requests.put((request, client_address))
+
+    def _worker(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self):
+        WSGIServer.server_close(self)
+        for _ in self._threads:
+            self._requests.put(None)
+
+
+def make_pooled_server(host, port, app, mode='thread', workers=None, queue_size=64,
+                       handler_class=WSGIRequestHandler):
+    """Create a WSGI server for ``app`` using one of SERVER_MODES."""
+    if mode == 'simple':
+        httpd = WSGIServer((host, port), handler_class)
+    elif mode == 'thread':
+        httpd = PooledWSGIServer((host, port), handler_class, workers=workers, queue_size=queue_size)
+    else:
+        raise ValueError("unknown server mode: {}".format(mode))
+    httpd.set_app(app)
+    return httpd
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Coalescing of identical concurrent computations ("single flight").
+
+The first caller for a key runs the function; callers arriving with the same
+key while it runs wait for it and receive the same result (or exception)
+instead of repeating the work.
+"""
+
+import threading
+
+
+class _Call(object):
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0  # callers served by another caller's computation
+
+    def do(self, key, fn, *args):
+        """Return fn(*args), computed at most once at a time per key."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.shared += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn(*args)
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
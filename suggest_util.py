@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Headword suggestions: prefix completion over an in-memory sorted key array,
+and "did you mean" corrections from a delete dictionary stored beside the index."""
+
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from urllib.request import pathname2url
+
+from metrics_util import INDEX_BUILD_SECONDS
+
+
+DEFAULT_SUGGEST_LIMIT = 10
+# hard cap on suggestions per request, whatever the client asks for
+MAX_SUGGEST_LIMIT = 50
+
+
+class PrefixIndex(object):
+    """Sorted, case-folded array of headwords searched with bisect.
+
+    ``_folded`` is sorted and ``_keys`` holds the original spelling at the same
+    position; when folding does not change a key both lists share the string.
+    """
+
+    def __init__(self, keys):
+        pairs = []
+        for key in keys:
+            if not key:
+                continue
+            folded = key.casefold()
+            pairs.append((folded if folded != key else key, key))
+        pairs.sort()
+        self._folded = [folded for folded, _ in pairs]
+        self._keys = [key for _, key in pairs]
+
+    @classmethod
+    def from_builder(cls, builder):
+        return cls(builder.get_mdx_keys())
+
+    def __len__(self):
+        return len(self._keys)
+
+    def suggest(self, prefix, limit=DEFAULT_SUGGEST_LIMIT):
+        """Return up to ``limit`` distinct headwords starting with prefix, ignoring case."""
+        limit = max(0, min(limit, MAX_SUGGEST_LIMIT))
+        folded = (prefix or '').casefold()
+        if not folded or not limit:
+            return []
+        result = []
+        seen = set()
+        i = bisect_left(self._folded, folded)
+        n = len(self._folded)
+        while i < n and len(result) < limit and self._folded[i].startswith(folded):
+            key = self._keys[i]
+            if key not in seen:
+                seen.add(key)
+                result.append(key)
+            i += 1
+        return result
+
+
+# SymSpell-style delete dictionary: every headword is stored under each string
+# obtained by deleting up to MAX_EDIT_DISTANCE characters from its first
+# SPELL_PREFIX_LENGTH characters.  A misspelt query generates the same deletes
+# of its own prefix, so candidates come from one indexed IN query of at most
+# 1 + 7 + 21 keys and are then verified with a real edit distance.
+MAX_EDIT_DISTANCE = 2
+SPELL_PREFIX_LENGTH = 7
+SPELL_INDEX_VERSION = 'spell-v1'
+# candidate rows considered per query (very short queries match a lot)
+SPELL_MAX_CANDIDATES = 2000
+DEFAULT_SPELL_LIMIT = 5
+
+
+def _deletes(word, max_distance):
+    result = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        next_frontier = set()
+        for item in frontier:
+            if len(item) <= 1:
+                continue
+            for i in range(len(item)):
+                next_frontier.add(item[:i] + item[i + 1:])
+        next_frontier -= result
+        result |= next_frontier
+        frontier = next_frontier
+    return result
+
+
+def edit_distance(a, b, max_distance=MAX_EDIT_DISTANCE):
+    """Optimal string alignment distance (adjacent transpositions count as one edit).
+
+    Returns max_distance + 1 as soon as the distance is known to exceed it.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    prev_prev = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if prev_prev is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, prev_prev[j - 2] + 1)
+            cur[j] = value
+        if min(cur) > max_distance:
+            return max_distance + 1
+        prev_prev, prev = prev, cur
+    return prev[-1]
+
+
+class SpellIndex(object):
+    """"Did you mean" lookups backed by a delete dictionary in a SQLite file.
+
+    The file (``<dictionary>.mdx.spell.db``) lives beside the ``.mdx.db`` index
+    and is rebuilt when the dictionary's identity or the index format changes.
+    """
+
+    def __init__(self, db_path, source_id, keys_factory):
+        self.db_path = db_path
+        self._local = threading.local()
+        if self._stored_source() != source_id:
+            self._build(source_id, keys_factory())
+
+    @classmethod
+    def for_builder(cls, builder):
+        source_id = '{};{}'.format(SPELL_INDEX_VERSION, builder.get_identity()[0])
+        db_path = os.path.splitext(builder.get_mdx_db())[0] + '.spell.db'
+        return cls(db_path, source_id, builder.get_mdx_keys)
+
+    def _stored_source(self):
+        if not os.path.isfile(self.db_path):
+            return None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                row = conn.execute("SELECT value FROM META WHERE key = 'source'").fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def _build(self, source_id, keys):
+        started = time.perf_counter()
+        tmp_path = self.db_path + '.tmp'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.execute('CREATE TABLE DELETES (del_text text not null, key_text text not null)')
+            conn.execute('CREATE TABLE META (key text, value text)')
+            seen = set()
+
+            def rows():
+                for key in keys:
+                    folded = key.casefold() if key else key
+                    if not folded or key in seen:
+                        continue
+                    seen.add(key)
+                    for item in _deletes(folded[:SPELL_PREFIX_LENGTH], MAX_EDIT_DISTANCE):
+                        yield item, key
+
+            conn.executemany('INSERT INTO DELETES VALUES (?,?)', rows())
+            conn.execute('CREATE INDEX del_index ON DELETES (del_text)')
+            conn.execute("INSERT INTO META VALUES ('source', ?)", (source_id,))
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, self.db_path)
+        INDEX_BUILD_SECONDS.observe(time.perf_counter() - started, 'spell')
+
+    def _conn(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.pid = os.getpid()
+            local.conn = sqlite3.connect('file:{}?mode=ro'.format(pathname2url(os.path.abspath(self.db_path))),
+                                         uri=True)
+        return local.conn
+
+    def suggest(self, word, limit=DEFAULT_SPELL_LIMIT, max_distance=MAX_EDIT_DISTANCE):
+        """Return up to ``limit`` headwords within ``max_distance`` edits of word, closest first."""
+        folded = (word or '').casefold()
+        if not folded or limit <= 0:
+            return []
+        max_distance = min(max_distance, MAX_EDIT_DISTANCE)
+        probes = list(_deletes(folded[:SPELL_PREFIX_LENGTH], max_distance))
+        cursor = self._conn().execute(
+            "SELECT DISTINCT key_text FROM DELETES WHERE del_text IN ({}) LIMIT ?".format(','.join('?' * len(probes))),
+            probes + [SPELL_MAX_CANDIDATES])
+        scored = []
+        for (key,) in cursor:
+            distance = edit_distance(folded, key.casefold(), max_distance)
+            if distance <= max_distance:
+                scored.append((distance, abs(len(key) - len(word)), key))
+        scored.sort()
+        return [key for _, _, key in scored[:limit]]
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Slots, queue and shedding of admission_util.AdmissionController.
+
+Run: python -m unittest test_admission
+"""
+
+import threading
+import time
+import unittest
+
+import mdx_server
+from admission_util import RETRY_AFTER_SECONDS, AdmissionController, default_limits
+
+
+class AdmissionControllerTest(unittest.TestCase):
+    def test_sheds_once_slots_and_queue_are_full(self):
+        controller = AdmissionController(limit=1, queue_depth=0)
+        self.assertTrue(controller.acquire())
+        self.assertFalse(controller.acquire())
+        self.assertEqual(controller.rejected, 1)
+        controller.release()
+        self.assertTrue(controller.acquire())
+
+    def test_queued_request_gets_the_released_slot(self):
+        controller = AdmissionController(limit=1, queue_depth=1, queue_timeout=5)
+        self.assertTrue(controller.acquire())
+        admitted = []
+        waiter = threading.Thread(target=lambda: admitted.append(controller.acquire()))
+        waiter.start()
+        while controller.waiting == 0:
+            time.sleep(0.001)
+        # the queue is full now, so a third request is shed at once
+        self.assertFalse(controller.acquire())
+        controller.release()
+        waiter.join()
+        self.assertEqual(admitted, [True])
+        self.assertEqual((controller.running, controller.waiting, controller.rejected), (1, 0, 1))
+
+    def test_queued_request_times_out(self):
+        controller = AdmissionController(limit=1, queue_depth=1, queue_timeout=0.05)
+        self.assertTrue(controller.acquire())
+        started = time.time()
+        self.assertFalse(controller.acquire())
+        self.assertGreaterEqual(time.time() - started, 0.05)
+        self.assertEqual((controller.waiting, controller.rejected), (0, 1))
+
+    def test_default_limits_leave_workers_for_cheap_requests(self):
+        for workers in (1, 2, 4, 8, 32):
+            limit, queue_depth = default_limits(workers)
+            self.assertGreaterEqual(limit, 1)
+            self.assertGreaterEqual(queue_depth, 0)
+            if workers >= 4:
+                self.assertLess(limit + queue_depth, workers)
+
+
+class OverloadResponseTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = mdx_server.admission
+        mdx_server.admission = AdmissionController(limit=1, queue_depth=0)
+
+    def tearDown(self):
+        mdx_server.admission = self.saved
+
+    def test_shed_request_gets_503_with_retry_after(self):
+        environ = {}
+        self.assertTrue(mdx_server._admit(environ))
+        self.assertTrue(environ['mdx.admitted'])
+        shed = {}
+        self.assertFalse(mdx_server._admit(shed))
+        self.assertNotIn('mdx.admitted', shed)
+        responses = []
+        body = mdx_server._overloaded(lambda status, headers: responses.append((status, headers)))
+        status, headers = responses[0]
+        self.assertEqual(status, '503 Service Unavailable')
+        self.assertIn(('Retry-After', str(RETRY_AFTER_SECONDS)), headers)
+        self.assertIn(b'"error"', b''.join(body))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Resolution of words by mdx_util.get_definitions_batch.
+
+Run: python -m unittest test_batch
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mdx_util
+from mdict_query import IndexBuilder
+from test_negative_cache import write_mdx
+
+
+ENTRIES = [('Paris', '<p>capital</p>'), ('apple', '<p>fruit</p>'), ('banana', '<p>fruit</p>'), ('run', '<p>move</p>')]
+
+
+class BatchResolutionTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        path = os.path.join(self.tmp, 'd.mdx')
+        write_mdx(path, ENTRIES)
+        self.builder = IndexBuilder(path)
+        mdx_util.json_cache.discard_matching(lambda key: True)
+        mdx_util.negative_cache.discard_matching(lambda key: True)
+
+    def tearDown(self):
+        self.builder.close()
+        shutil.rmtree(self.tmp)
+
+    def batch(self, words):
+        return json.loads(mdx_util.get_definitions_batch(words, self.builder).decode('utf-8'))
+
+    def test_headwords_lemmas_and_misses(self):
+        result = self.batch(['apple', 'apples', 'running', 'Paris', 'banaan'])
+        self.assertEqual(list(result), ['apple', 'apples', 'running', 'Paris', 'banaan'])
+        self.assertEqual(result['apple']['word'], 'apple')
+        self.assertEqual(result['apples']['word'], 'apple')
+        self.assertEqual(result['running']['word'], 'run')
+        self.assertEqual(result['Paris']['word'], 'Paris')
+        self.assertNotIn('found', result['apple'])
+        self.assertEqual(result['banaan'], {'word': 'banaan', 'found': False, 'suggestions': ['banana']})
+
+    def test_duplicates_are_answered_once(self):
+        body = mdx_util.get_definitions_batch(['apple', 'apple'], self.builder)
+        self.assertEqual(body.count(b'"apple":'), 1)
+
+    def test_matches_single_lookups_and_is_cached(self):
+        words = ['apple', 'apples', 'zzzz']
+        first = self.batch(words)
+        hits = mdx_util.json_cache.hits
+        self.assertEqual(self.batch(words), first)
+        self.assertEqual(mdx_util.json_cache.hits - hits, len(words))
+        mdx_util.json_cache.discard_matching(lambda key: True)
+        mdx_util.negative_cache.discard_matching(lambda key: True)
+        for word in words:
+            single = json.loads(b''.join(mdx_util.get_definition_json(word, self.builder)).decode('utf-8'))
+            self.assertEqual(single, first[word])
+
+    def test_without_dictionary(self):
+        body = mdx_util.get_definitions_batch(['apple'], None)
+        self.assertEqual(json.loads(body.decode('utf-8')), {'apple': {'word': 'apple', 'found': False}})
+
+
+if __name__ == '__main__':
+    unittest.main()
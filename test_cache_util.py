@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Admission and eviction of cache_util.TinyLFUCacheBytes.
+
+One shard whose window holds two values and whose main area holds 198; the
+budget is large enough for a wide sketch, so collisions do not decide a test.
+
+Run: python -m unittest test_cache_util
+"""
+
+import unittest
+
+from cache_util import TinyLFUCacheBytes
+
+
+MAX_BYTES = 1 << 24
+VALUE = b'x' * (MAX_BYTES // 200)
+
+
+def _cache():
+    return TinyLFUCacheBytes(max_bytes=MAX_BYTES, shards=1)
+
+
+def _scan(cache, count, prefix='cold'):
+    for i in range(count):
+        cache.set('{}-{}'.format(prefix, i), VALUE)
+
+
+class TinyLFUTest(unittest.TestCase):
+    def test_stays_within_budget(self):
+        cache = _cache()
+        _scan(cache, 1000)
+        self.assertLessEqual(cache.current_bytes, cache.max_bytes)
+        self.assertGreater(cache.evictions, 0)
+        self.assertEqual(len(cache), cache.current_bytes // len(VALUE))
+
+    def test_hot_entry_survives_a_scan(self):
+        cache = _cache()
+        cache.set('hot', VALUE)
+        _scan(cache, 2, prefix='filler')  # push hot out of the window
+        for _ in range(5):
+            self.assertEqual(cache.get('hot'), VALUE)
+        _scan(cache, 2000)
+        self.assertEqual(cache.get('hot'), VALUE)
+
+    def test_frequent_newcomer_displaces_cold_entry(self):
+        cache = _cache()
+        _scan(cache, 400)
+        for _ in range(5):
+            self.assertIsNone(cache.get('new'))
+        cache.set('new', VALUE)
+        _scan(cache, 2, prefix='filler')
+        self.assertEqual(cache.get('new'), VALUE)
+
+    def test_one_off_newcomer_is_not_admitted_over_the_main_area(self):
+        cache = _cache()
+        _scan(cache, 400)
+        before = cache.evictions
+        cache.set('once', VALUE)
+        _scan(cache, 2, prefix='filler')
+        self.assertIsNone(cache.get('once'))
+        self.assertGreater(cache.evictions, before)
+
+    def test_oversized_value_is_not_cached(self):
+        cache = _cache()
+        cache.set('big', b'x' * (MAX_BYTES + 1))
+        self.assertIsNone(cache.get('big'))
+        self.assertEqual(cache.current_bytes, 0)
+
+    def test_shrinking_evicts_at_once(self):
+        cache = _cache()
+        _scan(cache, 400)
+        cache.resize(MAX_BYTES // 5)
+        self.assertLessEqual(cache.current_bytes, MAX_BYTES // 5)
+
+    def test_discard_matching(self):
+        cache = _cache()
+        cache.set('a:1', VALUE)
+        cache.set('b:1', VALUE)
+        self.assertEqual(cache.discard_matching(lambda key: key.startswith('a:')), 1)
+        self.assertIsNone(cache.get('a:1'))
+        self.assertEqual(cache.get('b:1'), VALUE)
+        self.assertEqual(cache.current_bytes, len(VALUE))
+
+    def test_hottest_keys(self):
+        cache = _cache()
+        cache.set('warm', VALUE)
+        cache.set('hot', VALUE)
+        for _ in range(3):
+            cache.get('hot')
+        cache.get('warm')
+        self.assertEqual(cache.hottest_keys(2), ['hot', 'warm'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Byte ranges and validators of http_util.
+
+Run: python -m unittest test_http_util
+"""
+
+import unittest
+
+from http_util import (RANGE_NOT_SATISFIABLE, http_date, is_not_modified, make_etag, range_response,
+                       requested_range)
+
+
+LENGTH = 1000
+ETAG = make_etag('d.mdd', 'sound.mp3', 42)
+MTIME = 1500000000
+
+
+def _environ(method='GET', **headers):
+    environ = {'REQUEST_METHOD': method}
+    for name, value in headers.items():
+        environ['HTTP_' + name.upper()] = value
+    return environ
+
+
+class RequestedRangeTest(unittest.TestCase):
+    def assertRange(self, header, expected, **headers):
+        self.assertEqual(requested_range(_environ(range=header, **headers), LENGTH, ETAG, MTIME), expected)
+
+    def test_no_range_is_whole_body(self):
+        self.assertIsNone(requested_range(_environ(), LENGTH))
+
+    def test_explicit_range_is_inclusive(self):
+        self.assertRange('bytes=0-99', (0, 100))
+        self.assertRange('bytes=500-', (500, LENGTH))
+
+    def test_range_past_the_end_is_clipped(self):
+        self.assertRange('bytes=900-5000', (900, LENGTH))
+
+    def test_suffix_range(self):
+        self.assertRange('bytes=-100', (900, LENGTH))
+        self.assertRange('bytes=-5000', (0, LENGTH))
+        self.assertRange('bytes=-0', RANGE_NOT_SATISFIABLE)
+
+    def test_start_past_the_end_is_not_satisfiable(self):
+        self.assertRange('bytes=1000-', RANGE_NOT_SATISFIABLE)
+
+    def test_malformed_and_multiple_ranges_are_ignored(self):
+        for header in ('bytes=5-1', 'bytes=a-b', 'items=0-1', 'bytes=0-1,5-6', 'bytes=5'):
+            self.assertRange(header, None)
+
+    def test_only_get_is_ranged(self):
+        environ = _environ('HEAD', range='bytes=0-1')
+        self.assertIsNone(requested_range(environ, LENGTH, ETAG, MTIME))
+
+    def test_if_range(self):
+        self.assertRange('bytes=0-1', (0, 2), if_range=ETAG)
+        self.assertRange('bytes=0-1', None, if_range=make_etag('other'))
+        self.assertRange('bytes=0-1', None, if_range='W/' + ETAG)
+        self.assertRange('bytes=0-1', (0, 2), if_range=http_date(MTIME))
+        self.assertRange('bytes=0-1', None, if_range=http_date(MTIME - 1))
+
+    def test_range_response(self):
+        status, headers = range_response(LENGTH, (0, 100))
+        self.assertEqual(status, '206 Partial Content')
+        self.assertIn(('Content-Range', 'bytes 0-99/1000'), headers)
+        self.assertIn(('Content-Length', '100'), headers)
+        status, headers = range_response(LENGTH, RANGE_NOT_SATISFIABLE)
+        self.assertEqual(status, '416 Range Not Satisfiable')
+        self.assertIn(('Content-Range', 'bytes */1000'), headers)
+
+
+class NotModifiedTest(unittest.TestCase):
+    def test_etag_is_stable_and_quoted(self):
+        self.assertEqual(make_etag('a', 1), make_etag('a', 1))
+        self.assertNotEqual(make_etag('a', 1), make_etag('a', 2))
+        self.assertTrue(ETAG.startswith('"') and ETAG.endswith('"'))
+
+    def test_if_none_match(self):
+        self.assertTrue(is_not_modified(_environ(if_none_match=ETAG), ETAG))
+        self.assertTrue(is_not_modified(_environ(if_none_match='"x", ' + ETAG), ETAG))
+        self.assertTrue(is_not_modified(_environ(if_none_match='W/' + ETAG), ETAG))
+        self.assertTrue(is_not_modified(_environ(if_none_match='*'), ETAG))
+        self.assertFalse(is_not_modified(_environ(if_none_match='"x"'), ETAG))
+
+    def test_if_none_match_takes_precedence(self):
+        environ = _environ(if_none_match='"x"', if_modified_since=http_date(MTIME))
+        self.assertFalse(is_not_modified(environ, ETAG, MTIME))
+
+    def test_if_modified_since(self):
+        self.assertTrue(is_not_modified(_environ(if_modified_since=http_date(MTIME)), ETAG, MTIME))
+        self.assertFalse(is_not_modified(_environ(if_modified_since=http_date(MTIME - 1)), ETAG, MTIME))
+        self.assertFalse(is_not_modified(_environ(if_modified_since='garbage'), ETAG, MTIME))
+
+    def test_only_safe_methods(self):
+        self.assertFalse(is_not_modified(_environ('POST', if_none_match=ETAG), ETAG))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Suffix rules and memo of lemma.
+
+Run: python -m unittest test_lemma
+"""
+
+import unittest
+
+from lemma import ChainLemmatizer, MemoLemmatizer, RuleLemmatizer
+
+
+class RuleLemmatizerTest(unittest.TestCase):
+    def assertFirst(self, word, lemma):
+        candidates = RuleLemmatizer().candidates(word)
+        self.assertTrue(candidates, word)
+        self.assertEqual(candidates[0], lemma, word)
+
+    def test_irregular_forms(self):
+        self.assertEqual(RuleLemmatizer().candidates('went'), ['go'])
+        self.assertEqual(RuleLemmatizer().candidates('Mice'), ['mouse'])
+
+    def test_plurals(self):
+        for word, lemma in (('cities', 'city'), ('wolves', 'wolf'), ('boxes', 'box'), ('cakes', 'cake'),
+                            ('dogs', 'dog'), ("dog's", 'dog')):
+            self.assertFirst(word, lemma)
+
+    def test_past_and_participles(self):
+        for word, lemma in (('carried', 'carry'), ('stopped', 'stop'), ('hoped', 'hope'), ('walked', 'walk'),
+                            ('running', 'run'), ('lying', 'lie'), ('walking', 'walk')):
+            self.assertFirst(word, lemma)
+
+    def test_comparatives_and_adverbs(self):
+        for word, lemma in (('happiest', 'happy'), ('greatest', 'great'), ('happier', 'happy'),
+                            ('smaller', 'small'), ('happily', 'happy'), ('quickly', 'quick')):
+            self.assertFirst(word, lemma)
+
+    def test_base_forms_have_no_candidates(self):
+        for word in ('glass', 'bus', 'the', 'dog'):
+            self.assertEqual(RuleLemmatizer().candidates(word), [], word)
+
+    def test_candidates_are_distinct_and_exclude_the_word(self):
+        for word in ('stopped', 'wolves', 'boxes', 'running'):
+            candidates = RuleLemmatizer().candidates(word)
+            self.assertEqual(len(candidates), len(set(candidates)))
+            self.assertNotIn(word, candidates)
+
+
+class _Counting(object):
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    def candidates(self, word):
+        self.calls += 1
+        return list(self.result)
+
+
+class MemoLemmatizerTest(unittest.TestCase):
+    def test_memoizes(self):
+        inner = _Counting(['base'])
+        memo = MemoLemmatizer(inner)
+        self.assertEqual(memo.candidates('word'), ('base',))
+        self.assertEqual(memo.candidates('word'), ('base',))
+        self.assertEqual(inner.calls, 1)
+
+    def test_evicts_least_recently_used(self):
+        inner = _Counting(['base'])
+        memo = MemoLemmatizer(inner, size=2)
+        memo.candidates('a')
+        memo.candidates('b')
+        memo.candidates('a')
+        memo.candidates('c')  # evicts b
+        memo.candidates('a')
+        self.assertEqual(inner.calls, 3)
+        memo.candidates('b')
+        self.assertEqual(inner.calls, 4)
+
+    def test_lemmatize_many(self):
+        memo = MemoLemmatizer(RuleLemmatizer())
+        self.assertEqual(memo.lemmatize_many(['dogs', 'went', 'dogs']), {'dogs': ('dog',), 'went': ('go',)})
+
+    def test_chain_keeps_order_without_duplicates(self):
+        chain = ChainLemmatizer(_Counting(['a', 'b']), _Counting(['b', 'c']))
+        self.assertEqual(chain.candidates('word'), ['a', 'b', 'c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
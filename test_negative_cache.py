@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Regression check: a miss on "Apple" must not hide the headword "apple".
+
+Run: python -m unittest test_negative_cache
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+from struct import pack
+
+import mdx_util
+from mdict_query import IndexBuilder
+
+
+def _block(data):
+    return b'\x02\x00\x00\x00' + pack('>I', zlib.adler32(data) & 0xffffffff) + zlib.compress(data)
+
+
+def write_mdx(path, entries):
+    """A minimal version 2.0 MDX file (UTF-8, one key block, one record block) of sorted (key, html)."""
+    header = ('<Dictionary GeneratedByEngineVersion="2.0" RequiredEngineVersion="2.0" Encrypted="No" '
+              'Encoding="UTF-8" Format="Html" Title="T" Description="D"/>\r\n\x00').encode('utf-16-le')
+    out = pack('>I', len(header)) + header + pack('<I', zlib.adler32(header) & 0xffffffff)
+    keys = b''
+    records = b''
+    for key, html in entries:
+        keys += pack('>Q', len(records)) + key.encode('utf-8') + b'\x00'
+        records += html.encode('utf-8') + b'\x00'
+    key_block = _block(keys)
+    first, last = entries[0][0].encode('utf-8'), entries[-1][0].encode('utf-8')
+    info = (pack('>Q', len(entries)) + pack('>H', len(first)) + first + b'\x00' + pack('>H', len(last)) + last
+            + b'\x00' + pack('>Q', len(key_block)) + pack('>Q', len(keys)))
+    info_block = _block(info)
+    numbers = pack('>5Q', 1, len(entries), len(info), len(info_block), len(key_block))
+    out += numbers + pack('>I', zlib.adler32(numbers) & 0xffffffff) + info_block + key_block
+    record_block = _block(records)
+    out += pack('>4Q', 1, len(entries), 16, len(record_block)) + pack('>2Q', len(record_block), len(records))
+    with open(path, 'wb') as f:
+        f.write(out + record_block)
+
+
+class NegativeCacheCaseTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        path = os.path.join(self.tmp, 'd.mdx')
+        write_mdx(path, [('apple', '<p>apple</p>'), ('banana', '<p>banana</p>')])
+        self.builder = IndexBuilder(path)
+        mdx_util.negative_cache.discard_matching(lambda key: True)
+
+    def tearDown(self):
+        self.builder.close()
+        shutil.rmtree(self.tmp)
+
+    def test_capitalised_miss_does_not_hide_headword(self):
+        html, _ = mdx_util._lookup_entry_html('Apple', self.builder)
+        self.assertEqual(html, '')
+        html, word = mdx_util._lookup_entry_html('apple', self.builder)
+        self.assertIn('apple', html)
+        self.assertEqual(word, 'apple')
+
+    def test_capitalised_miss_does_not_hide_headword_in_batch(self):
+        mdx_util.get_definitions_batch(['Apple'], self.builder)
+        body = mdx_util.get_definitions_batch(['apple'], self.builder).decode('utf-8')
+        self.assertNotIn('"found":false', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
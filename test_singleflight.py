@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Coalescing of concurrent calls by singleflight_util.SingleFlight.
+
+Run: python -m unittest test_singleflight
+"""
+
+import threading
+import time
+import unittest
+
+from singleflight_util import SingleFlight
+
+
+class SingleFlightTest(unittest.TestCase):
+    def _run_concurrently(self, flight, fn, callers=5):
+        """Start callers threads on one key while fn blocks; return their results or exceptions."""
+        results = []
+
+        def call():
+            try:
+                results.append(flight.do('word', fn))
+            except Exception as exc:
+                results.append(exc)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        while flight.leaders + flight.shared < callers:
+            time.sleep(0.001)
+        return threads, results
+
+    def test_concurrent_callers_share_one_computation(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait()
+            return 'result'
+
+        threads, results = self._run_concurrently(flight, compute)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['result'] * 5)
+        self.assertEqual((flight.leaders, flight.shared), (1, 4))
+
+    def test_error_reaches_every_caller(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def fail():
+            release.wait()
+            raise ValueError('broken')
+
+        threads, results = self._run_concurrently(flight, fail, callers=3)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    def test_key_is_free_again_after_completion(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do('word', lambda: 1), 1)
+        self.assertEqual(flight.do('word', lambda: 2), 2)
+        self.assertEqual((flight.leaders, flight.shared), (2, 0))
+
+    def test_arguments_are_passed(self):
+        self.assertEqual(SingleFlight().do('sum', lambda a, b: a + b, 2, 3), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
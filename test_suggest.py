@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Edit distance, "did you mean" and prefix suggestions of suggest_util.
+
+Run: python -m unittest test_suggest
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from suggest_util import PrefixIndex, SpellIndex, edit_distance
+
+
+KEYS = ['apple', 'apply', 'ample', 'banana', 'Paris', 'internationalization', 'cat', 'car']
+
+
+class EditDistanceTest(unittest.TestCase):
+    def test_distances(self):
+        self.assertEqual(edit_distance('apple', 'apple'), 0)
+        self.assertEqual(edit_distance('apple', 'aple'), 1)
+        self.assertEqual(edit_distance('apple', 'appple'), 1)
+        self.assertEqual(edit_distance('apple', 'apply'), 1)
+        self.assertEqual(edit_distance('apple', 'paple'), 1)  # one transposition
+        self.assertEqual(edit_distance('apple', 'ample'), 1)
+
+    def test_stops_past_the_limit(self):
+        self.assertEqual(edit_distance('apple', 'banana'), 3)
+        self.assertEqual(edit_distance('a', 'abcd'), 3)
+
+
+class SpellIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp, 'd.mdx.spell.db')
+        self.builds = 0
+        self.index = self._open('v1')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _keys(self):
+        self.builds += 1
+        return KEYS
+
+    def _open(self, source_id):
+        return SpellIndex(self.db_path, source_id, self._keys)
+
+    def test_closest_first(self):
+        self.assertEqual(self.index.suggest('appel'), ['apple', 'ample', 'apply'])
+        self.assertEqual(self.index.suggest('banaan'), ['banana'])
+
+    def test_limit_and_distance(self):
+        self.assertEqual(self.index.suggest('appel', limit=1), ['apple'])
+        self.assertEqual(self.index.suggest('appel', max_distance=1), ['apple'])
+        self.assertEqual(self.index.suggest('zzzzzz'), [])
+        self.assertEqual(self.index.suggest(''), [])
+
+    def test_ignores_case_and_keeps_headword_spelling(self):
+        self.assertEqual(self.index.suggest('PARIS'), ['Paris'])
+        self.assertEqual(self.index.suggest('pariss'), ['Paris'])
+
+    def test_long_words_match_on_their_prefix(self):
+        self.assertEqual(self.index.suggest('internationalisation'), ['internationalization'])
+
+    def test_rebuilt_only_when_source_changes(self):
+        self._open('v1')
+        self.assertEqual(self.builds, 1)
+        self._open('v2')
+        self.assertEqual(self.builds, 2)
+
+
+class PrefixIndexTest(unittest.TestCase):
+    def test_prefix_ignores_case(self):
+        index = PrefixIndex(KEYS)
+        self.assertEqual(index.suggest('ap'), ['apple', 'apply'])
+        self.assertEqual(index.suggest('pa'), ['Paris'])
+        self.assertEqual(index.suggest('ca', limit=1), ['car'])
+        self.assertEqual(index.suggest(''), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# version: python 3.7
+"""Cache warm-up at startup from word lists and access logs.
+
+A word file has one word per line, most frequent first, optionally followed
+by a tab or space and a count.  An access log is the JSON-lines log written
+by the server; the words of successful entry lookups are counted and the
+most requested ones are warmed first.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+
+# only the end of an access log is read: recent traffic is what matters
+WARMUP_LOG_TAIL_BYTES = 64 * 1024 * 1024
+WARMUP_ROUTES = ('api_entry', 'html', 'api_all')
+
+
+def _read_tail_lines(path, max_bytes):
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - max_bytes))
+        if size > max_bytes:
+            f.readline()  # skip the partial first line
+        for line in f:
+            yield line.decode('utf-8', 'ignore')
+
+
+def _is_access_log(path):
+    with open(path, 'rb') as f:
+        return f.read(1) == b'{'
+
+
+def read_access_log_words(path, max_bytes=WARMUP_LOG_TAIL_BYTES):
+    """Counter of the words successfully looked up in a JSON-lines access log."""
+    counts = Counter()
+    for line in _read_tail_lines(path, max_bytes):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        word = record.get('word')
+        if word and record.get('route') in WARMUP_ROUTES and record.get('status') in (200, 304):
+            counts[word] += 1
+    return counts
+
+
+def read_word_file(path):
+    """Words of a frequency-ranked list, in rank order (by count when counts are given)."""
+    words = []
+    counted = False
+    with open(path, encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            parts = line.strip().rsplit(None, 1)
+            if not parts:
+                continue
+            if len(parts) == 2 and parts[1].isdigit():
+                words.append((parts[0], int(parts[1])))
+                counted = True
+            else:
+                words.append((line.strip(), 0))
+    if counted:
+        words.sort(key=lambda item: -item[1])
+    return [word for word, _ in words]
+
+
+def load_warmup_words(paths, limit):
+    """Merge word files (in the given order) and access logs (by request count) into the top ``limit`` words."""
+    ranked = OrderedDict()
+    counts = Counter()
+    for path in paths:
+        if _is_access_log(path):
+            counts.update(read_access_log_words(path))
+        else:
+            for word in read_word_file(path):
+                ranked.setdefault(word, None)
+    for word, _ in counts.most_common():
+        ranked.setdefault(word, None)
+    return list(ranked)[:limit]
+
+
+class WarmUp(object):
+    """Run ``warm(word)`` for every word on ``workers`` threads within a time and memory budget.
+
+    ``used_bytes()`` is checked before each word; warm-up stops once it
+    reaches ``max_bytes`` or ``max_seconds`` have passed.  ``ready`` turns
+    true when ``threshold`` of the words are warm or warm-up has stopped.
+    """
+
+    def __init__(self, words, warm, used_bytes, max_bytes, workers=4, max_seconds=600.0, threshold=0.9):
+        self.words = words
+        self.warm = warm
+        self.used_bytes = used_bytes
+        self.max_bytes = max_bytes
+        self.workers = max(1, workers)
+        self.max_seconds = max_seconds
+        self.threshold = threshold
+        self.done = 0
+        self.failed = 0
+        self.finished = False
+        self.stop_reason = None
+        self.started = None
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @property
+    def total(self):
+        return len(self.words)
+
+    @property
+    def ready(self):
+        return self.finished or self.done >= self.threshold * self.total
+
+    def status(self):
+        return {'ready': self.ready, 'warmed': self.done, 'failed': self.failed, 'total': self.total,
+                'finished': self.finished, 'stop_reason': self.stop_reason}
+
+    def _take(self, deadline):
+        with self._lock:
+            if self.stop_reason is not None:
+                return None
+            if self._next >= len(self.words):
+                self.stop_reason = 'complete'
+                return None
+            if time.time() >= deadline:
+                self.stop_reason = 'time budget'
+                return None
+            if self.used_bytes() >= self.max_bytes:
+                self.stop_reason = 'memory budget'
+                return None
+            word = self.words[self._next]
+            self._next += 1
+            return word
+
+    def _work(self, deadline):
+        while True:
+            word = self._take(deadline)
+            if word is None:
+                return
+            try:
+                self.warm(word)
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                continue
+            with self._lock:
+                self.done += 1
+
+    def run(self):
+        """Warm in the calling thread until done; returns status()."""
+        self.started = time.time()
+        deadline = self.started + self.max_seconds
+        threads = [threading.Thread(target=self._work, args=(deadline,), name='warmup', daemon=True)
+                   for _ in range(min(self.workers, max(1, self.total)))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.finished = True
+        return self.status()
+
+    def start(self):
+        """Warm in a background thread."""
+        threading.Thread(target=self.run, name='warmup', daemon=True).start()
+        return self